@@ -0,0 +1,223 @@
+""" Headless benchmarks of world loading, visible face updates, projection,
+picking and editing, over the maps in worlds.zip and generated worlds.
+
+Run with e.g. python benchmark.py --sizes 32 64 --output results.json
+The results are JSON so runs on different commits can be compared.
+"""
+import argparse
+import os
+import random
+import subprocess
+import tempfile
+import tracemalloc
+import zipfile
+from model import *
+from profiler import *
+from projector import *
+
+def flat_world(size: int) -> list[list[str]]:
+    """ A grass floor with a layer of dirt under it """
+    layers = [['N' * size] * size, ['G' * size] * size]
+    return layers + [['.' * size] * size] * (size - 2)
+
+def terrain_world(size: int, seed: int = 0) -> list[list[str]]:
+    """ Rolling hills of random height """
+    generator = random.Random(seed)
+    waves = [(generator.uniform(0.05, 0.3), generator.uniform(0.05, 0.3),
+              generator.uniform(0, 2*pi)) for _ in range(4)]
+    heights = []
+    for y in range(size):
+        row = []
+        for x in range(size):
+            height = sum(sin(a*x + b*y + c) for a, b, c in waves)
+            row.append(int(size/4 + height * size/16))
+        heights.append(row)
+    layers = []
+    for z in range(size):
+        layer = []
+        for y in range(size):
+            line = ''
+            for x in range(size):
+                height = heights[y][x]
+                if z < height - 3:
+                    line += 'K'
+                elif z < height:
+                    line += 'N'
+                elif z == height:
+                    line += 'G'
+                else:
+                    line += '.'
+            layer.append(line)
+        layers.append(layer)
+    return layers
+
+def hollow_world(size: int) -> list[list[str]]:
+    """ The shell of a cube """
+    wall = ['W' * size] * size
+    middle = ['W' * size] + ['W' + '.' * (size - 2) + 'W'] * (size - 2)
+    middle += ['W' * size]
+    return [wall] + [middle] * (size - 2) + [wall]
+
+def dense_world(size: int) -> list[list[str]]:
+    """ A solid cube """
+    return [['R' * size] * size] * size
+
+SYNTHETIC_WORLDS = {'flat': flat_world,
+                    'terrain': terrain_world,
+                    'hollow': hollow_world,
+                    'dense': dense_world}
+
+def camera_path(size: int, frames: int
+                ) -> list[tuple[tuple[float, float, float], float, float]]:
+    """ Returns (position, horizontal angle, vertical angle) for each frame
+    of a circle flown above a world, looking in towards its middle """
+    path = []
+    for i in range(frames):
+        angle = 2*pi*i / frames
+        pos = (size/2 + size/3*cos(angle), size/2 + size/3*sin(angle),
+               size + 2)
+        # the camera's horizontal angle turns clockwise from the x axis
+        h_angle = (-degrees(angle) + 180) % 360
+        path.append((pos, h_angle, -40))
+    return path
+
+def benchmark_world(path: str, size: int, frames: int, edits: int,
+                    projectors: list[ParallelProjector] = ()) -> dict:
+    """ Loads the map at path and times a flight around it and a sequence of
+    edits. Each frame is also projected with each of projectors. """
+    start = time.perf_counter()
+    world = WorldModel(path, None)
+    load_time = time.perf_counter() - start
+    cubes = len(world.cubes)
+    world_file = os.path.splitext(path)[0] + WORLD_EXTENSION
+    start = time.perf_counter()
+    save_world(world.cubes, world_file)
+    save_time = time.perf_counter() - start
+    start = time.perf_counter()
+    WorldModel(world_file, None)
+    binary_load_time = time.perf_counter() - start
+    # the first load fills the cache and the second reads from it
+    cache_dir = os.path.join(os.path.dirname(path), 'cache')
+    WorldModel(path, cache_dir)
+    start = time.perf_counter()
+    WorldModel(path, cache_dir)
+    cached_load_time = time.perf_counter() - start
+    tracemalloc.start()
+    measured = WorldModel(path, None)
+    memory, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del measured
+
+    camera = world.camera
+    profiler = FrameProfiler()
+    for pos, h_angle, v_angle in camera_path(size, frames):
+        camera.set_pos(Point(pos))
+        camera.update()
+        camera.direction = (camera.direction[0], h_angle, v_angle)
+        camera.matrix = camera.get_rotation_matrix()
+        with profiler.stage('visible_faces'):
+            camera.update_visible_faces(world)
+        with profiler.stage('projection'):
+            coords, counts = camera.window_coords_batch(
+                camera.get_visible_vertices())
+        for projector in projectors:
+            with profiler.stage(f'projection_{projector.workers}_workers'):
+                projector.window_coords_batch(camera,
+                                              camera.get_visible_vertices())
+        with profiler.stage('picking'):
+            camera.update_face_looked_at(world.cubes)
+        profiler.count('faces', len(counts))
+        profiler.end_frame()
+    frame_stats = profiler.get_stats()
+
+    # break and place cubes at random positions in the world
+    generator = random.Random(1)
+    profiler = FrameProfiler()
+    for i in range(edits):
+        coords = tuple(generator.randrange(size) for _ in range(3))
+        with profiler.stage('edit'):
+            if coords in world.cubes:
+                world.remove_cube(coords)
+            else:
+                world.add_cube(Cube(Point(coords), 'B'))
+        with profiler.stage('visible_faces'):
+            camera.update_visible_faces(world)
+        profiler.end_frame()
+    edit_stats = profiler.get_stats()
+    for stats in (frame_stats, edit_stats):
+        stats.pop('frame')
+        stats.pop('allocated_blocks')
+    return {'cubes': cubes,
+            'load_ms': load_time * 1000,
+            'save_ms': save_time * 1000,
+            'binary_load_ms': binary_load_time * 1000,
+            'cached_load_ms': cached_load_time * 1000,
+            'memory_bytes': memory,
+            'peak_memory_bytes': peak,
+            'frames': {name: dict(zip(('mean', 'p95', 'max'), values))
+                       for name, values in frame_stats.items()},
+            'edits': {name: dict(zip(('mean', 'p95', 'max'), values))
+                      for name, values in edit_stats.items()}}
+
+def get_commit() -> str | None:
+    """ Returns the hash of the checked out commit, if there is one """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--maps', default='worlds.zip',
+                        help='zip file of maps to benchmark')
+    parser.add_argument('--sizes', type=int, nargs='*', default=[32, 64],
+                        help='sizes of the generated worlds, up to 128')
+    parser.add_argument('--worlds', nargs='*',
+                        default=list(SYNTHETIC_WORLDS),
+                        choices=list(SYNTHETIC_WORLDS),
+                        help='which generated worlds to benchmark')
+    parser.add_argument('--frames', type=int, default=120,
+                        help='frames to fly around each world for')
+    parser.add_argument('--edits', type=int, default=50,
+                        help='cubes to break or place in each world')
+    parser.add_argument('--workers', type=int, nargs='*', default=[],
+                        help='also time parallel projection with each of '
+                             'these numbers of worker processes')
+    parser.add_argument('--output', help='file to write the results to')
+    args = parser.parse_args()
+    # every frame goes to the workers, however few faces it has, so that
+    # the timings are of the workers rather than of the fallback
+    projectors = [ParallelProjector(workers, min_faces=0)
+                  for workers in args.workers]
+
+    results = {'commit': get_commit(), 'worlds': {}}
+    with tempfile.TemporaryDirectory() as directory:
+        maps = []
+        if os.path.exists(args.maps):
+            with zipfile.ZipFile(args.maps) as archive:
+                for name in archive.namelist():
+                    if name.endswith('.txt'):
+                        path = archive.extract(name, directory)
+                        maps.append((os.path.basename(name), path, 32))
+        for size in args.sizes:
+            for name in args.worlds:
+                path = os.path.join(directory, f'{name}_{size}.txt')
+                write_map(path, SYNTHETIC_WORLDS[name](size))
+                maps.append((f'{name}_{size}', path, size))
+        for name, path, size in maps:
+            print(f'benchmarking {name}', file=sys.stderr)
+            results['worlds'][name] = benchmark_world(path, size, args.frames,
+                                                      args.edits, projectors)
+    for projector in projectors:
+        projector.close()
+    output = json.dumps(results, indent=1)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
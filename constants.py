@@ -1,3 +1,9 @@
+# the game is simulated in ticks of TICK_LENGTH seconds, and all speeds and
+# accelerations below are per tick. At most MAX_TICKS_PER_FRAME ticks are
+# caught up on between two frames before the game is allowed to slow down
+TICK_LENGTH = 0.02
+MAX_TICKS_PER_FRAME = 10
+
 SPRINT_SPEED = 0.3
 WALK_SPEED = 0.2
 
@@ -5,6 +11,20 @@ GRAVITY = -0.06
 
 JUMP = (-8) * GRAVITY
 
+# the player's bounding box relative to the camera
+PLAYER_HALF_WIDTH = 0.3
+PLAYER_BELOW_EYE = 1.62
+PLAYER_ABOVE_EYE = 0.18
+# boxes closer than this to a cube are treated as touching it
+COLLISION_EPSILON = 1e-7
+
+# how far away the player can break and place cubes
+REACH = 5
+
+# how far shots travel in shooting mode and how many cubes they go through
+SHOT_RANGE = 64
+SHOT_PIERCE = 3
+
 #VALID_KEYS = ['w', 'a', 's', 'd', 'space', 'shift_l', 'control_l']
 
 XY = [(1,0,0), (0,1,0)]
@@ -27,6 +47,108 @@ COLOURS = {'R': '#e50000',  # red
            'U': '#760088',  # purple
            'P': '#ffafc7'}  # pink
 
+# faces further than this from the camera are not drawn
+RENDER_DISTANCE = 64
+
+# 'polygon' draws each face as a canvas polygon in painter's order, while
+# 'zbuffer' rasterises the faces into an image with a depth buffer at
+# 1/ZBUFFER_SCALE of the window's resolution
+RENDER_BACKEND = 'polygon'
+ZBUFFER_SCALE = 4
+# brightness of faces pointing in each direction of DELTAS in the z-buffer
+FACE_SHADES = [0.5, 1, 0.7, 0.8, 0.8, 0.7]
+
+# the profiler's statistics cover the last PROFILE_WINDOW frames, and up to
+# PROFILE_HISTORY frames are written to PROFILE_FILE (.csv or .json) on
+# quitting, if it is set
+PROFILE_WINDOW = 120
+PROFILE_HISTORY = 100000
+PROFILE_FILE = None
+
+# block types are stored as indices into PALETTE, with 0 meaning empty
+PALETTE = '.' + ''.join(COLOURS)
+PALETTE_INDEX = {cube_type: i for i, cube_type in enumerate(PALETTE)}
+
+# chunks of the world are cubes with side length CHUNK_SIZE = 2**CHUNK_BITS
+CHUNK_BITS = 4
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_VOLUME = CHUNK_SIZE ** 3
+# translates palette indices back into block types
+PALETTE_BYTES = PALETTE.encode('ascii').ljust(256, b'.')
+
+# binary world files (see support.write_world). Chunks are compressed with
+# zlib at level WORLD_COMPRESSION, or stored as they are if it is 0
+WORLD_EXTENSION = '.world'
+WORLD_MAGIC = b'CUBW'
+WORLD_VERSION = 1
+WORLD_COMPRESSION = 6
+SAVE_FILE = 'worlds/new_world' + WORLD_EXTENSION
+
+# maps not found on disk are read from WORLDS_ZIP. Loaded worlds are cached
+# in CACHE_DIR, and caches written by a different CACHE_VERSION are ignored
+WORLDS_ZIP = 'worlds.zip'
+CACHE_DIR = 'worlds/cache'
+CACHE_VERSION = 1
+
+# procedural terrain (see terrain.py). Chunks are generated by TERRAIN_WORKERS
+# processes, at most TERRAIN_IN_FLIGHT at a time, for every column of chunks
+# within TERRAIN_RADIUS chunks of the camera, and unloaded once further than
+# TERRAIN_UNLOAD_RADIUS. At most TERRAIN_CHUNKS_PER_FRAME finished chunks
+# are added to the world each frame
+TERRAIN_WORKERS = 2
+TERRAIN_IN_FLIGHT = 8
+TERRAIN_RADIUS = 4
+TERRAIN_UNLOAD_RADIUS = 6
+TERRAIN_CHUNKS_PER_FRAME = 2
+# the ground is TERRAIN_BASE cubes high plus noise with an (amplitude,
+# wavelength) for each octave, and never reaches TERRAIN_HEIGHT
+TERRAIN_BASE = 6
+TERRAIN_OCTAVES = [(12, 48), (6, 16), (2, 6)]
+TERRAIN_HEIGHT = 32
+# block types from the surface down, with any ground below water level
+# covered in sand
+TERRAIN_SURFACE = 'G'
+TERRAIN_SOIL = 'N'
+TERRAIN_SOIL_DEPTH = 3
+TERRAIN_ROCK = 'K'
+TERRAIN_SAND = 'Y'
+TERRAIN_WATER = 'B'
+TERRAIN_WATER_LEVEL = 9
+
+# edits made since the last save are appended to journals next to the world
+# file (see support.read_journal). The world is saved every
+# AUTOSAVE_INTERVAL seconds if it has been edited, or only when asked if
+# AUTOSAVE_INTERVAL is None
+JOURNAL_SUFFIX = '.journal'
+AUTOSAVE_INTERVAL = 60
+
+# recordings of the input to a game (see recorder.py), with each event being
+# one of RECORDING_KINDS
+RECORDING_MAGIC = b'CUBR'
+RECORDING_VERSION = 2
+RECORDING_KINDS = ('keypress', 'keyrelease', 'motion', 'lclick', 'rclick',
+                   'look', 'quit')
+
+# merge neighbouring faces of the same colour into quads of up to
+# MESH_MAX_SPAN by MESH_MAX_SPAN faces. Keeping the quads small keeps the
+# painter's algorithm drawing them in roughly the right order
+GREEDY_MESHING = True
+MESH_MAX_SPAN = 4
+
+# procedural terrain chunks whose nearest point is further from the camera
+# than each distance are drawn one level coarser, each level merging 2x2x2
+# cells of the level below into one cell of their most common block type.
+# Cells with fewer cubes than one layer of them are left empty, so pillars
+# and other features thinner than a cell vanish in the distance. Maps are
+# small enough to always be drawn in full
+LOD_DISTANCES = [24, 40]
+
+# project faces on PROJECTION_WORKERS processes (see ParallelProjector), or
+# in the game's own process if it is 0. Frames with fewer than
+# PARALLEL_MIN_FACES faces are always projected in the game's process
+PROJECTION_WORKERS = 0
+PARALLEL_MIN_FACES = 2000
+
 HOTBAR_COLOURS = {'1': 'R',
                   '2': 'O',
                   '3': 'Y',
@@ -1,30 +1,151 @@
+import pyautogui
+import time
 from view import *
+from saver import *
+from terrain import *
+from projector import *
+from recorder import *
 
 class CubeGame():
-    def __init__(self, master: tk.Tk, world_file: str) -> None:
+    """ Runs the game.
+
+    The game is simulated in fixed ticks of TICK_LENGTH seconds, and frames
+    are drawn as often as time allows in between. Each frame catches up on
+    the ticks that are due before drawing, so a slow frame means fewer
+    frames rather than slower movement. Frames draw the camera part way
+    between its positions at the start and end of the current tick.
+
+    Nothing is redrawn unless something that changes the picture happened
+    since the last frame: the camera moving or turning, the world being
+    edited or the HUD or menu changing. These mark the frame as dirty.
+    Mouse movements between two frames are added up and applied as a
+    single look update.
+
+    The world is saved to a world file next to world_file, which is loaded
+    instead of world_file once it exists (see WorldSaver). Procedural
+    terrain is streamed in around the player instead (see TerrainStreamer)
+    and is not saved.
+
+    The input can be recorded to a file and replayed later (see
+    InputRecorder and InputReplay). Every event is stamped with the number
+    of ticks simulated before it arrived, and a replay feeds each event
+    through the same handler just before the next tick, so the game sees
+    the same input at the same ticks and ends with the same world. Recorded
+    and replayed games start from world_file itself rather than its save
+    or journals and are not saved, so a recording can be replayed any number
+    of times. The recording holds the hash of the world it started from,
+    and is refused if world_file no longer hashes the same.
+    Replays of procedural terrain may differ, as what has been generated by
+    each tick depends on how fast the workers are.
+    """
+
+    def __init__(self, master: tk.Tk, world_file: str | None,
+                 start_time: float | None = None,
+                 seed: int | None = None,
+                 recording: str | None = None,
+                 replay: InputReplay | None = None,
+                 headless: bool = False,
+                 profile_file: str | None = PROFILE_FILE) -> None:
+        """ Sets up the game in master, playing world_file or, if seed is
+        given, procedural terrain generated from seed. If start_time is
+        given, the time from it (a time.perf_counter value) until the first
+        frame has been drawn is reported as the startup time.
+
+        The input is recorded to the file recording if given, or taken from
+        replay instead of the user if given. A headless replay simulates
+        its ticks as fast as it can without drawing anything. Every frame
+        is written to profile_file when the game is quit, if given (see
+        FrameProfiler.dump). """
         self.master = master
         
-        self.world_model = WorldModel(world_file)
+        self.profiler = FrameProfiler()
+        self.show_profile = False
+        self.start_time = start_time
+        self.profile_file = profile_file
+        self.replay = replay
+        self.headless = headless and replay is not None
+        self.running = True
+        # the number of ticks simulated so far
+        self.ticks = 0
+        if replay:
+            # the mouse positions recorded only make sense in the same window
+            self.width = replay.width
+            self.height = replay.height
+        else:
+            self.height = master.winfo_screenheight()
+            self.width = master.winfo_screenwidth()
+        self.projector = None
+        if PROJECTION_WORKERS:
+            self.projector = ParallelProjector(PROJECTION_WORKERS)
+        # show the window while the world loads
+        self.world_view = WorldView(master, self.width, self.height,
+                                    self.profiler, self.projector)
+        self.world_view.pack()
+        self.world_view.draw_loading(f'Loading {world_file or "terrain"}')
+        master.update()
+        self.saver = None
+        self.streamer = None
+        if seed is None and (recording or replay):
+            # from the map as it is, not as edits since its last save left it
+            self.world_model = WorldModel(world_file, CACHE_DIR,
+                                          replay_journal=False)
+        elif seed is None:
+            save_file = get_save_file(world_file)
+            if os.path.exists(save_file):
+                world_file = save_file
+            self.world_model = WorldModel(world_file, CACHE_DIR)
+            self.saver = WorldSaver(self.world_model, save_file)
+        else:
+            self.world_model = WorldModel(None, lod_distances=LOD_DISTANCES)
+            self.streamer = TerrainStreamer(self.world_model, seed)
+        if replay and replay.world_hash != self.world_model.get_hash():
+            raise ValueError(f'{world_file} has changed since the recording '
+                             f'was made, so it cannot be replayed')
+        self.recorder = None
+        if recording:
+            self.recorder = InputRecorder(recording, world_file, seed,
+                                          self.world_model.get_hash(),
+                                          self.width, self.height)
+        self.world_view.draw_loading(None)
         self.player = self.world_model.player
         self.camera = self.world_model.camera
-        self.camera.update_visible_faces(self.world_model.cubes)
+        if self.streamer:
+            # start standing on the ground
+            x, y, _ = self.camera.pos.coords
+            z = self.streamer.get_height(x, y) + PLAYER_BELOW_EYE
+            self.camera.set_pos(Point((x, y, z)))
         self.pressed_keys = []
-        self.height = master.winfo_screenheight()
-        self.width = master.winfo_screenwidth()
-        self.world_view = WorldView(master, self.width, self.height)
-        self.world_view.pack()
-        master.bind('<KeyPress>', self.handle_keypress)
-        master.bind('<KeyRelease>', self.handle_keyrelease)
-        master.bind('<Motion>', self.handle_mouse)
-        master.bind('<Button-1>', self.handle_lclick)
-        master.bind('<Button-3>', self.handle_rclick)
+        self.camera.set_aspect(self.height / self.width)
+        self.update_visible_faces()
+        master.protocol('WM_DELETE_WINDOW', self.quit)
+        if not replay:
+            master.bind('<KeyPress>', self.handle_keypress)
+            master.bind('<KeyRelease>', self.handle_keyrelease)
+            master.bind('<Motion>', self.handle_mouse)
+            master.bind('<Button-1>', self.handle_lclick)
+            master.bind('<Button-3>', self.handle_rclick)
+        # the handler each kind of replayed event is fed through
+        self.handlers = {'keypress': self.handle_keypress,
+                         'keyrelease': self.handle_keyrelease,
+                         'motion': self.handle_mouse,
+                         'lclick': self.handle_lclick,
+                         'rclick': self.handle_rclick,
+                         'look': lambda event: self.handle_look(),
+                         'quit': lambda event: self.quit()}
         self.oldx = self.width//2
         self.oldy = self.height//2
-        pyautogui.moveTo(self.width//2, self.height//2)
+        self.centre_cursor()
         #master.set_cursor('None')
         self.selected_colour = 'R'
         self.shooting_mode = False
         self.menu = False
+        self.dirty = True
+        self.last_time = time.perf_counter()
+        # time passed that has not been simulated yet
+        self.accumulator = 0
+        # mouse movement since the last frame
+        self.look_dx = 0
+        self.look_dy = 0
 
         midx = self.width//2
         midy = self.height//2
@@ -57,43 +178,108 @@ class CubeGame():
                                          midx-400,midy+350,
                                          midx+400,midy+400,
                                          'Quit Game'))
+        self.world_view.draw_hud(self.selected_colour)
         self.update()
         #print('end of CubeGame init')
 
+    def update_visible_faces(self) -> None:
+        with self.profiler.stage('visible_faces'):
+            self.camera.update_visible_faces(self.world_model)
+
+    def update_face_looked_at(self) -> None:
+        with self.profiler.stage('face_looked_at'):
+            self.camera.update_face_looked_at(self.world_model.cubes)
+
+    def quit(self) -> None:
+        """ Writes out the profile if profile_file is set, waits for any save
+        being written and closes the game. A replay prints where it ended
+        up, to compare with other runs of the same recording. """
+        self.running = False
+        if self.profile_file:
+            self.profiler.dump(self.profile_file)
+        if self.recorder:
+            self.recorder.close(self.ticks)
+        if self.replay:
+            print(f'replayed {self.ticks} ticks')
+            print(f'camera at {self.camera.pos.coords}, looking '
+                  f'{self.camera.direction}')
+            print(f'world hash {self.world_model.get_hash()}')
+            print(self.profiler.get_text())
+        if self.saver:
+            self.saver.close()
+        if self.streamer:
+            self.streamer.close()
+        if self.projector:
+            self.projector.close()
+        self.master.destroy()
+
     def redraw(self) -> None:
-        self.world_view.delete('all')
         if self.menu:
             self.world_view.draw_menu(self.buttons)
         else:
             visible_faces = self.camera.get_visible_faces()
-            self.camera.update_face_looked_at(visible_faces)
+            self.update_face_looked_at()
             face_looked_at = self.camera.get_face_looked_at()
             self.world_view.redraw(visible_faces, face_looked_at, self.camera,
                                self.selected_colour, self.shooting_mode)
 
+    def mark_dirty(self) -> None:
+        """ Marks the frame as needing to be redrawn at the next tick """
+        self.dirty = True
+
+    def centre_cursor(self) -> None:
+        """ Moves the mouse to the middle of the screen, unless replaying """
+        if not self.replay:
+            pyautogui.moveTo(self.width//2, self.height//2)
+
+    def record(self, kind: str, event: tk.Event | None = None) -> None:
+        """ Records an event of kind at the current tick, if recording """
+        if self.recorder:
+            self.recorder.record(self.ticks, kind, event)
+
+    def replay_events(self) -> None:
+        """ Feeds the replayed events recorded before the next tick through
+        their handlers, and quits once the replay has finished """
+        for event in self.replay.get_events(self.ticks):
+            self.handlers[event.kind](event)
+            if not self.running:
+                return None
+        if self.replay.is_finished():
+            self.quit()
+
     def handle_keypress(self, event: tk.Event) -> None:
         #print(event.keysym)
+        self.record('keypress', event)
         if event.keysym == 'Escape':
+            self.mark_dirty()
             self.menu = not self.menu
             if self.menu:
                 #self.world_view.set_bg('brown')
-                pyautogui.moveTo(self.width//2, self.height//2)
+                self.centre_cursor()
             else:
                 self.shooting_mode = False
                 self.world_view.set_bg('sky blue')
+        if event.keysym in 'pP':
+            self.show_profile = not self.show_profile
+            self.mark_dirty()
+        if event.keysym in 'bB':
+            self.world_view.toggle_backend()
+            self.mark_dirty()
         if event.keysym in 'fF':
             self.player.set_flying(not self.player.is_flying())
             self.player.set_velocity(0)
         if event.keysym == 'space' and not self.player.is_flying():
-            if not self.player.get_velocity():
+            if self.player.is_on_ground():
                 self.player.set_velocity(JUMP)
         if event.keysym in '1234567890' or event.keysym == 'minus':
             self.selected_colour = HOTBAR_COLOURS[event.keysym]
+            self.mark_dirty()
         key = event.keysym.lower()
         if not key in self.pressed_keys:
             self.pressed_keys.append(key)
 
     def handle_keyrelease(self, event: tk.Event) -> None:
+        self.record('keyrelease', event)
         key = event.keysym.lower()
         try:
             self.pressed_keys.remove(key)
@@ -106,13 +292,27 @@ class CubeGame():
         else:
             self.player.set_speed(WALK_SPEED)
             
+        old_pos = self.camera.pos.coords
         new_cube = self.world_model.move_player(self.pressed_keys)
         if new_cube:
-            self.camera.update_visible_faces(self.world_model.cubes)
+            self.update_visible_faces()
             self.camera.update()
-        self.redraw()
+        if self.camera.pos.coords != old_pos:
+            self.mark_dirty()
+
+    def handle_look(self) -> None:
+        """ Turns the camera by the mouse movement since the last frame """
+        if self.look_dx or self.look_dy:
+            self.record('look')
+            self.camera.look(self.look_dx, self.look_dy)
+            self.look_dx = 0
+            self.look_dy = 0
+            # faces that have come into view need to be found
+            self.update_visible_faces()
+            self.mark_dirty()
 
     def handle_mouse(self, event: tk.Event) -> None:
+        self.record('motion', event)
         x = event.x
         y = event.y
         dx = x - self.oldx
@@ -125,16 +325,17 @@ class CubeGame():
         if self.menu:
             #yes
             for button in self.buttons:
-                if button.x1 < x < button.x2 and button.y1 < y < button.y2:
-                    button.hover = True
-                else:
-                    button.hover = False
+                hover = button.x1 < x < button.x2 and button.y1 < y < button.y2
+                if hover != button.hover:
+                    button.hover = hover
+                    self.mark_dirty()
         else:
-            self.camera.look(dx, dy)
+            self.look_dx += dx
+            self.look_dy += dy
             # reset cursor position when you reach the edge of the screen
             if (x < 10 or x > (self.width - 10) or
                 y < 10 or y > (self.height - 10)):
-                pyautogui.moveTo(self.width//2, self.height//2)
+                self.centre_cursor()
                 self.oldx = self.width//2
                 self.oldy = self.height//2
 
@@ -142,7 +343,9 @@ class CubeGame():
         #left click has occurred
         #print(self.world_view.face_looked_at)
         #print('lclick')
+        self.record('lclick', event)
         if self.menu:
+            self.mark_dirty()
             x = event.x
             y = event.y
             button_name = ''
@@ -166,59 +369,114 @@ class CubeGame():
             if button_name == 'FOV 90':
                 self.camera.set_fov(90)
             if button_name == 'Save World':
-                save_world(self.world_model.cubes)
+                if self.saver:
+                    self.saver.save()
             if button_name == 'Quit Game':
-                self.master.destroy()
+                self.quit()
+                return None
+            # the field of view may have changed
+            self.update_visible_faces()
             return None
         
         if self.shooting_mode:
-            to_remove = []
-            for coords in self.world_model.cubes:
-                cube = self.world_model.cubes[coords]
-                #print(list(cube.get_faces().values()))
-                #problem is that the faces are two separate identical faces, two instances
-                #print(list(cube.get_faces().values())[1])
-                #print(self.world_view.face_looked_at == list(cube.get_faces().values())[1])
-                for face in list(cube.get_faces().values()):
-                    if self.camera.looking_at(face):
-                        #print(f'removing cube at {coords}')
-                        to_remove.append(coords)
-            for coords in to_remove:
-                neighbours = Point(coords).get_adjacent()
-                for neighbour in neighbours:
-                    #print(f'removing neighbour of {coords} at {neighbour}')
-                    self.world_model.remove_cube(neighbours[neighbour])
-                self.world_model.remove_cube(coords)
-            self.camera.update_visible_faces(self.world_model.cubes)
+            direction = Point(pol_to_cart(self.camera.direction))
+            to_remove = self.world_model.hit_scan(self.camera.pos, direction,
+                                                  SHOT_RANGE, SHOT_PIERCE)
+            self.world_model.remove_cubes(to_remove)
+            self.update_visible_faces()
+            self.mark_dirty()
             return None
 
-        face_looked_at = self.camera.get_face_looked_at()
-        if face_looked_at:
-            # camera is looking at a face
-            for coords in self.world_model.cubes:
-                cube = self.world_model.cubes[coords]
-                for face in list(cube.get_faces().values()):
-                    if face_looked_at == face:
-                        #print(f'removing cube at {coords}')
-                        self.world_model.remove_cube(coords)
-                        self.camera.update_visible_faces(self.world_model.cubes)
-                        return None
+        # look again, as the world may have changed since the last frame
+        self.update_face_looked_at()
+        cube_looked_at = self.camera.get_cube_looked_at()
+        if cube_looked_at:
+            # camera is looking at a cube
+            self.world_model.remove_cube(cube_looked_at)
+            self.update_visible_faces()
+            self.mark_dirty()
     
     def handle_rclick(self, event: tk.Event) -> None:
-        face = self.camera.get_face_looked_at()
+        self.record('rclick', event)
+        self.update_face_looked_at()
+        new_corner = self.camera.get_placement_cell()
         #print('right click')
-        if face:
-            # get coord for new cube
-            #print('am lookin at somethin rn')
-            new_corner = face.get_facing()
-            self.world_model.add_cube(Cube(new_corner, self.selected_colour))
-            self.camera.update_visible_faces(self.world_model.cubes)
+        if new_corner:
+            # camera is looking at a face with an empty cell in front of it
+            self.world_model.add_cube(Cube(Point(new_corner),
+                                           self.selected_colour))
+            self.update_visible_faces()
+            self.mark_dirty()
     
-    def update(self) -> None:
-        # do update stuff
+    def tick(self) -> None:
+        """ Advances the simulation by one tick """
+        if self.camera.is_interpolating():
+            # the last frame was drawn short of where the camera ended up
+            self.mark_dirty()
+        self.camera.start_tick()
+        if self.streamer and not self.streamer.is_loaded(self.camera.pos):
+            # wait for the terrain around the player to be generated
+            return None
         if not self.player.is_flying():
             v = self.player.get_velocity()
             self.player.set_velocity(v + GRAVITY)
             #print(v)
         self.handle_keys()
-        self.master.after(20, self.update)
+
+    def update(self) -> None:
+        # do update stuff
+        now = time.perf_counter()
+        elapsed = min(now - self.last_time, MAX_TICKS_PER_FRAME*TICK_LENGTH)
+        if self.headless:
+            # one tick per update, as fast as it will go
+            elapsed = TICK_LENGTH
+        self.accumulator += elapsed
+        self.last_time = now
+        while self.accumulator >= TICK_LENGTH:
+            if self.replay:
+                self.replay_events()
+                if not self.running:
+                    return None
+            with self.profiler.stage('simulate'):
+                self.tick()
+            self.ticks += 1
+            self.accumulator -= TICK_LENGTH
+        self.camera.set_alpha(self.accumulator / TICK_LENGTH)
+        if self.camera.is_interpolating():
+            self.mark_dirty()
+        if not self.replay:
+            # replays turn the camera where the recording says it turned
+            self.handle_look()
+        if self.saver:
+            self.saver.update()
+        if self.streamer:
+            with self.profiler.stage('terrain'):
+                if self.streamer.update(self.camera.pos):
+                    self.update_visible_faces()
+                    self.mark_dirty()
+        if self.headless:
+            # nothing is drawn, so go straight on to the next tick
+            self.dirty = False
+            self.profiler.end_frame()
+            self.master.after(0, self.update)
+            return None
+        if self.dirty:
+            self.dirty = False
+            self.redraw()
+            with self.profiler.stage('paint'):
+                # have Tk draw the canvas now so its time can be measured
+                self.master.update_idletasks()
+            self.profiler.end_frame()
+            if self.start_time is not None:
+                self.profiler.set_startup(
+                    (time.perf_counter() - self.start_time) * 1000)
+                self.start_time = None
+            if self.show_profile:
+                self.world_view.draw_profile(self.profiler.get_text())
+            else:
+                self.world_view.draw_profile(None)
+            delay = 1
+        else:
+            # nothing to draw until the next tick
+            delay = (TICK_LENGTH - self.accumulator) * 1000
+        self.master.after(max(int(delay), 1), self.update)
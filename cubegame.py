@@ -1,19 +1,59 @@
+import time
+# taken before anything else is imported, to time the game's startup
+START_TIME = time.perf_counter()
+
+import argparse
 # from tkinter import filedialog # For masters task
 # from typing import Callable, Union, Optional
 from model import *
 from view import *
 from controller import *
 
-def play_game(root: tk.Tk, world_file: str) -> None:
-    CubeGame(root, world_file)
+def play_game(root: tk.Tk, world_file: str | None,
+              seed: int | None = None, **options) -> None:
+    """ Plays world_file, or terrain from seed, in root. options are passed
+    on to CubeGame. """
+    CubeGame(root, world_file, START_TIME, seed, **options)
     root.mainloop()
 
 def main() -> None:
-    """ Constructs the root window and calls the play_game function. """
+    """ Constructs the root window and calls the play_game function. The map
+    to play can be given by name (see find_map), and defaults to
+    new_world. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('map', nargs='?', default='new_world',
+                        help='the map to play')
+    parser.add_argument('--seed', type=int,
+                        help='play procedural terrain from this seed instead')
+    inputs = parser.add_mutually_exclusive_group()
+    inputs.add_argument('--record', metavar='FILE',
+                        help='record the input to FILE, starting from the '
+                        'map rather than its save and without saving')
+    inputs.add_argument('--replay', metavar='FILE',
+                        help='replay the input recorded in FILE')
+    parser.add_argument('--headless', action='store_true',
+                        help='replay as fast as possible without drawing')
+    parser.add_argument('--profile', metavar='FILE', default=PROFILE_FILE,
+                        help='write the time of every frame to FILE (.csv '
+                        'or .json) on quitting')
+    args = parser.parse_args()
+    if args.headless and not args.replay:
+        parser.error('--headless only applies to --replay')
     root = tk.Tk()
-    root.attributes("-fullscreen", True)
-    world_file = 'worlds/new_world.txt'
-    play_game(root, world_file)
+    replay = None
+    if args.replay:
+        replay = InputReplay(args.replay)
+        world_file, seed = replay.world_file, replay.seed
+    else:
+        world_file, seed = None, args.seed
+        if seed is None:
+            world_file = find_map(args.map)
+    if args.headless:
+        root.withdraw()
+    else:
+        root.attributes("-fullscreen", True)
+    play_game(root, world_file, seed, recording=args.record, replay=replay,
+              headless=args.headless, profile_file=args.profile)
 
 if __name__ == '__main__':
     main()
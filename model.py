@@ -1,9 +1,12 @@
-import pyautogui
 import tkinter as tk
+import numpy as np
+from collections.abc import MutableMapping
 from constants import *
 from support import *
 
 class Point():
+    __slots__ = ('coords', 'x', 'y', 'z')
+
     def __init__(self, coords: tuple[float, float, float]):
         self.coords = coords
         self.x = coords[0]
@@ -21,8 +24,8 @@ class Point():
         """ Returns the corner points of the six adjacent cubes to self """
         neighbours = {}
         for delta in DELTAS:
-            neighbour = self + Point(delta)
-            neighbours[delta] = neighbour.coords
+            dx, dy, dz = delta
+            neighbours[delta] = (self.x + dx, self.y + dy, self.z + dz)
         return neighbours
 
     def get_intersect(self, other: 'Point', x: float) -> tuple[float, float]:
@@ -34,11 +37,11 @@ class Point():
         return (y, z)
         
     def scale(self, a: float) -> 'Point':
-        return self * Point((a,a,a))
+        return Point((self.x * a, self.y * a, self.z * a))
 
     def get_magnitude(self) -> float:
         """ Return the magnitude of self """
-        return self.distance(Point((0,0,0)))
+        return (self.x**2 + self.y**2 + self.z**2)**0.5
 
     def get_unit(self) -> 'Point':
         """ Return the unit vector with the same direction as self """
@@ -60,7 +63,11 @@ class Point():
         return Point((x,y,z))
 
     def __sub__(self, other: 'Point') -> 'Point':
-        return self + other.scale(-1)
+        """ Returns the vector difference of self and other """
+        x = self.x - other.x
+        y = self.y - other.y
+        z = self.z - other.z
+        return Point((x,y,z))
 
     def __eq__(self, other: 'Point') -> bool:
         return self.coords == other.coords
@@ -78,21 +85,31 @@ class Point():
         this class identical to self."""
         return f'{self.get_class_name()}({self.coords})'
 
+# the positive unit vector normal to each type of plane, shared by every face
+PLANE_NORMALS = ((XY, Point((0,0,1))),
+                 (XZ, Point((0,1,0))),
+                 (YZ, Point((1,0,0))))
+
 class Face():
     """ A 2D rectangle defined by two corner points
 
     Attributes:
         corners: A tuple containing two opposite corners of the rectangle
-        plane: The plane which this face is parallel to
+        plane_type: The plane which this face is parallel to
+        normal: The positive unit vector normal to the face
         facing: 1 if facing the positing direction, -1 otherwise
         exposed: True if adjacent to empty space
     """
+    __slots__ = ('corners', 'plane_type', 'normal', 'facing', 'exposed')
     
-    def __init__(self, corner1: Point, corner2: Point, facing: int) -> None:
+    def __init__(self, corner1: Point, corner2: Point, facing: int,
+                 plane_type: list[tuple[float, float, float]] = None) -> None:
         self.corners = (corner1, corner2)
-        self.plane_type = None
+        self.plane_type = plane_type
         self.plane_type = self.get_plane_type()
-        self.plane = self.get_plane()
+        for other_type, normal in PLANE_NORMALS:
+            if other_type == self.plane_type:
+                self.normal = normal
         self.facing = facing
         self.exposed = True
 
@@ -123,23 +140,32 @@ class Face():
 
     def get_normal(self) -> Point:
         """ Returns the positive unit vector normal to face's plane """
-        a, b = self.plane_type
-        return Point((1,1,1)) - Point(a) - Point(b)
+        return self.normal
 
     def get_plane(self) -> Point:
         """ Returns the plane that this face lies within described as a point.
         E.g. Plane with equation y = 5 returns Point((0,5,0))"""
-        return self.get_normal() * self.corners[0]
+        return self.normal * self.corners[0]
+
+    @property
+    def plane(self) -> Point:
+        return self.get_plane()
         
     def get_vertices(self) -> list[Point]:
         c1, c2 = self.corners
-        diff = c2 - c1
-        vertices = []
-        vertices.append(self.corners[0])
-        vertices.append(c1 + diff*Point(self.plane_type[0]))
-        vertices.append(self.corners[1])
-        vertices.append(c1 + diff*Point(self.plane_type[1]))
-        return vertices
+        coords = self.get_vertex_coords()
+        return [c1, Point(coords[1]), c2, Point(coords[3])]
+
+    def get_vertex_coords(self) -> list[tuple[float, float, float]]:
+        """ Returns the coordinates of the four vertices in drawing order """
+        c1, c2 = self.corners
+        x1, y1, z1 = c1.coords
+        dx, dy, dz = c2.x - x1, c2.y - y1, c2.z - z1
+        (ax, ay, az), (bx, by, bz) = self.plane_type
+        return [c1.coords,
+                (x1 + dx*ax, y1 + dy*ay, z1 + dz*az),
+                c2.coords,
+                (x1 + dx*bx, y1 + dy*by, z1 + dz*bz)]
 
     def __eq__(self, other: 'Face') -> bool:
         return (type(other).__name__ == 'Face' and
@@ -153,7 +179,15 @@ class Face():
         # self.corners[0] and [1] print str representation instead of repr
         return f'Face({self.corners[0]}, {self.corners[1]}, {self.facing})'
     
+# for each face of a cube, in the order of DELTAS, the indices into
+# Cube.vertices of its two corners along with its plane type and facing
+FACE_TEMPLATES = ((0, 3, XY, -1), (4, 7, XY, 1),
+                  (0, 5, XZ, -1), (2, 7, XZ, 1),
+                  (0, 6, YZ, -1), (1, 7, YZ, 1))
+
 class Cube():
+    __slots__ = ('corner', 'cube_type', 'vertices', 'faces')
+
     def __init__(self, corner: Point, cube_type: str = 'W') -> None:
         self.corner = corner
         self.cube_type = cube_type
@@ -162,30 +196,23 @@ class Cube():
 
     def get_vertices(self) -> list[Point]:
         #bottom back left vertex is coords
-        vertices = []
-        for i in range(8):
+        x, y, z = self.corner.coords
+        vertices = [self.corner]
+        for i in range(1, 8):
             dx = i // 1 % 2
             dy = i // 2 % 2
             dz = i // 4 % 2
-            new_vertex = self.corner + Point((dx,dy,dz))
-            vertices.append(new_vertex)
+            vertices.append(Point((x+dx, y+dy, z+dz)))
         return vertices
 
     def get_faces(self) -> dict[tuple[int, int, int], Face]:
+        # the faces share their corners with the cube's vertices
         faces = {}
-        corner_deltas = [(0,0,1), (0,1,0), (1,0,0)]
-        planes = [(1,1,0), (1,0,1), (0,1,1)]
-        for i in range(6):
-            if i % 2:
-                corner_delta = corner_deltas[i//2]
-            else:
-                corner_delta = (0,0,0)
-            corner = self.corner + Point(corner_delta)
-            plane = planes[i//2]
-            corner2 = corner + Point(plane)
-            facing = (-1) ** (i % 2 + 1)
-            new_face = Face(corner, corner2, facing)
-            faces[DELTAS[i]] = new_face
+        vertices = self.vertices
+        for delta, template in zip(DELTAS, FACE_TEMPLATES):
+            corner1, corner2, plane_type, facing = template
+            faces[delta] = Face(vertices[corner1], vertices[corner2], facing,
+                                plane_type)
         return faces
 
     def get_exposed(self) -> list[Face]:
@@ -200,10 +227,170 @@ class Cube():
         """ Returns the distance between the centres of self and other """
         return self.corner.distance(other.corner)
 
+def get_draw_order(centres: np.ndarray, cell: tuple[int, int, int],
+                   front_to_back: bool = False) -> tuple[np.ndarray,
+                                                         np.ndarray]:
+    """ Orders things in the grid for the painter's algorithm by the shell
+    of cells around cell their centres are in, without comparing them.
+
+    A cube can only hide one whose cell is further from the camera's cell
+    along every axis, and so further in total along the three axes (the
+    Manhattan distance). Drawing the shells of equal Manhattan distance
+    around the camera's cell furthest first therefore draws every cube
+    after any cube it hides, and the same holds for their faces facing the
+    camera. This only holds for things one cube across. Quads merged from
+    several faces and the quads of coarser levels of detail span several
+    shells and are ordered by the shell of their centre, so a quad can be
+    drawn before one it hides and the order is only roughly right for them.
+
+    Centres are at multiples of half a cube from the middle of cell, so
+    twice their distances are small whole numbers, which numpy's stable
+    sort buckets with a radix sort in linear time.
+
+    Parameters:
+        centres: Array of shape (n, 3) of the centres of the things drawn
+        cell: The corner of the cube the camera is in
+        front_to_back: If True, order nearest first instead, so a consumer
+            such as an occlusion test can stop at the first shell it finds
+            hidden
+
+    Returns:
+        A tuple (order, distances) where order is the indices of centres in
+        drawing order and distances is the Manhattan distance of each
+    """
+    offsets = np.abs(centres - (np.array(cell) + 0.5)).sum(axis=1)
+    shells = np.rint(2 * offsets).astype(np.int64)
+    if len(shells) and shells.max() < 1 << 16:
+        # numpy radix sorts 16 bit integers
+        shells = shells.astype(np.uint16)
+    order = np.argsort(shells, kind='stable')
+    if not front_to_back:
+        order = order[::-1]
+    return order, offsets
+
+# each of the five planes a face is clipped against can add one vertex
+CLIP_VERTICES = 9
+
+def get_clip_planes(distance: float, aspect: float) -> np.ndarray:
+    """ Returns the planes bounding the view of a camera whose window is at
+    distance in front of it and aspect times as tall as it is wide. These
+    are the window itself and the four planes through the camera and the
+    window's edges.
+
+    Returns:
+        A (5, 4) array where a point p in camera space is inside plane
+        (a, b, c, k) if a*p.x + b*p.y + c*p.z + k >= 0
+    """
+    # the window is 0.1 wide and 0.1*aspect tall (see Camera.in_view)
+    w = 0.05
+    h = 0.05 * aspect
+    d = distance
+    return np.array([[1, 0, 0, -d],
+                     [w, -d, 0, 0], [w, d, 0, 0],
+                     [h, 0, -d, 0], [h, 0, d, 0]], dtype=float)
+
+def clip_polygons(points: np.ndarray, planes: np.ndarray
+                  ) -> tuple[np.ndarray, np.ndarray]:
+    """ Clips convex polygons to planes (see get_clip_planes) with the
+    Sutherland-Hodgman algorithm, one plane at a time. Each vertex inside
+    the plane is kept, and each edge crossing it adds the point where it
+    crosses.
+
+    Parameters:
+        points: Array of shape (n, 4, 3) holding the vertices of n faces
+        planes: Array of shape (m, 4) of at most five planes
+
+    Returns:
+        A tuple (points, mask) where points is an (n, CLIP_VERTICES, 3)
+        array of the vertices of the clipped polygons and mask is an (n,
+        CLIP_VERTICES) array of which of them are used, always the first
+        few of each polygon.
+    """
+    n, size = points.shape[:2]
+    polygons = np.zeros((n, CLIP_VERTICES, 3))
+    polygons[:, :size] = points
+    counts = np.full(n, size)
+    rows = np.arange(n)[:, None]
+    for plane in planes:
+        current = polygons[:, :size]
+        index = np.arange(size)
+        used = index < counts[:, None]
+        distances = current @ plane[:3] + plane[3]
+        # the vertex after each vertex in its polygon
+        following = np.where(index + 1 < counts[:, None], index + 1, 0)
+        next_distances = distances[rows, following]
+        crosses = used & (distances * next_distances < 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = distances / (distances - next_distances)
+            crossings = current + t[..., None] * (current[rows, following]
+                                                  - current)
+        # each vertex followed by where its edge crosses, kept or not
+        candidates = np.empty((n, 2*size, 3))
+        candidates[:, 0::2] = current
+        candidates[:, 1::2] = crossings
+        keep = np.empty((n, 2*size), dtype=bool)
+        keep[:, 0::2] = used & (distances >= 0)
+        keep[:, 1::2] = crosses
+        # a convex polygon crosses a plane twice at most, so gains at most
+        # one vertex
+        size += 1
+        positions = np.cumsum(keep, axis=1) - 1
+        polygons[:, :size] = 0
+        polygons[np.nonzero(keep)[0], positions[keep]] = candidates[keep]
+        counts = keep.sum(axis=1)
+    return polygons, np.arange(CLIP_VERTICES) < counts[:, None]
+
+def project_points(points: np.ndarray, distance: float, aspect: float
+                   ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Clips faces whose vertices are in camera space (see
+    Camera.transform_vertices) to the view and projects them onto the
+    window at distance in front of the camera, which is aspect times as
+    tall as it is wide.
+
+    Faces entirely inside the view are projected as they are, and faces
+    with all their vertices outside one of the planes bounding the view
+    are dropped, so only faces crossing the edges of the view are clipped
+    (see clip_polygons), and only against the planes they cross.
+
+    Parameters:
+        points: Array of shape (n, 4, 3) holding the vertices of n faces
+
+    Returns:
+        A tuple (coords, mask, clipped) where coords is an (n,
+        CLIP_VERTICES, 2) array of up to CLIP_VERTICES window coordinates
+        for each face and mask is an (n, CLIP_VERTICES) array of which of
+        them are used, so that coords[mask] is every face's coordinates in
+        order. clipped is an (n,) array of which faces were clipped, and
+        faces with no coordinates were culled.
+    """
+    n = len(points)
+    planes = get_clip_planes(distance, aspect)
+    outside = points @ planes[:, :3].T + planes[:, 3] < 0
+    culled = outside.all(axis=1).any(axis=1)
+    clipped = outside.any(axis=(1, 2)) & ~culled
+    polygons = np.zeros((n, CLIP_VERTICES, 3))
+    mask = np.zeros((n, CLIP_VERTICES), dtype=bool)
+    polygons[:, :4] = points
+    mask[:, :4] = ~clipped[:, None] & ~culled[:, None]
+    if clipped.any():
+        # a plane no vertex is outside cannot cut the polygon
+        crossed = outside[clipped].any(axis=(0, 1))
+        polygons[clipped], mask[clipped] = clip_polygons(points[clipped],
+                                                         planes[crossed])
+    # unused vertices are projected too, so keep them off x = 0
+    depth = np.where(mask, polygons[..., 0], 1)
+    coords = distance * polygons[..., 1:] / depth[..., None]
+    clipped &= mask.any(axis=1)
+    return coords, mask, clipped
+
 class Camera():
     def __init__(self):
         self.speed = 0.4
         self.pos = Point((4.5,4.5,2.62))
+        # position at the start of the current tick and how far through the
+        # tick the next frame is drawn, for interpolating between ticks
+        self.previous_pos = None
+        self.alpha = 1
         self.cube_corner = self.get_cube_corner()
         self.cube = Cube(Point(self.cube_corner))
         # set fov between 30 degrees and 110 degrees
@@ -212,8 +399,16 @@ class Camera():
         d = 1 / (20 * tan(radians(self.fov)/2))
         self.direction = (d,315,0)
         self.matrix = self.get_rotation_matrix()
+        self.render_distance = RENDER_DISTANCE
+        # height of the window divided by its width
+        self.aspect = 9 / 16
         self.visible_faces = None
+        self.visible_vertices = np.empty((0,4,3))
+        self.culled_faces = 0
+        self.clipped_faces = 0
         self.face_looked_at = None
+        self.cube_looked_at = None
+        self.placement_cell = None
 
     def set_fov(self, fov: float) -> None:
         self.fov = fov
@@ -221,6 +416,35 @@ class Camera():
         _, x, y = self.direction
         self.direction = (d,x,y)
 
+    def set_render_distance(self, render_distance: float) -> None:
+        self.render_distance = render_distance
+
+    def set_aspect(self, aspect: float) -> None:
+        """ Sets the ratio of the window's height to its width """
+        self.aspect = aspect
+
+    def start_tick(self) -> None:
+        """ Records the position at the start of a simulation tick """
+        self.previous_pos = self.pos
+
+    def set_alpha(self, alpha: float) -> None:
+        """ Sets how far through the current tick the camera is drawn """
+        self.alpha = alpha
+
+    def is_interpolating(self) -> bool:
+        """ True if the camera moved during the current tick """
+        return (self.previous_pos is not None and
+                self.previous_pos.coords != self.pos.coords)
+
+    @property
+    def view_pos(self) -> Point:
+        """ The position the camera is drawn from, between its position at
+        the start and end of the current tick """
+        if not self.is_interpolating():
+            return self.pos
+        return self.previous_pos + (self.pos - self.previous_pos).scale(
+            self.alpha)
+
     def set_pos(self, position: Point) -> None:
         self.pos = position
         '''
@@ -233,25 +457,31 @@ class Camera():
         self.cube = Cube(Point(self.cube_corner))
         #self.matrix = self.get_rotation_matrix()
 
-    def update_face_looked_at(self, faces: list[list[Face], str, float]
-                              ) -> None:
-        face_looked_at = None
-        #change this to filter visible_faces to only the ones in the radius
-
-        
-        close_cubes = filter(lambda x: x[2] <= 6, faces)
-        for cube in close_cubes:
-            for face in cube[0]:
-                distance = self.looking_at(face)
-                if distance and distance < 5:
-                    #get distance to face
-                    face_looked_at = face
-        
-        self.face_looked_at = face_looked_at
+    def update_face_looked_at(self, cubes: dict) -> None:
+        """ Finds the first cube within reach along the camera's line of sight
+        by stepping through the grid from the camera's position """
+        self.face_looked_at = None
+        self.cube_looked_at = None
+        self.placement_cell = None
+        direction = Point(pol_to_cart(self.direction)).get_unit()
+        for cell, delta, _ in grid_traversal(self.pos.coords,
+                                             direction.coords, REACH):
+            if cell in cubes:
+                self.face_looked_at = cubes[cell].faces[delta]
+                self.cube_looked_at = cell
+                self.placement_cell = Point(cell).get_adjacent()[delta]
+                return None
 
     def get_face_looked_at(self) -> Face:
         return self.face_looked_at
 
+    def get_cube_looked_at(self) -> tuple[int, int, int] | None:
+        return self.cube_looked_at
+
+    def get_placement_cell(self) -> tuple[int, int, int] | None:
+        """ Returns the empty cell in front of the face looked at """
+        return self.placement_cell
+
     def get_intersect(self, face: Face) -> Point | None:
         """ Gets the intersection of the camera's line of sight and the plane
         that face lies within """
@@ -324,24 +554,111 @@ class Camera():
     def get_visible_faces(self) -> list:
         return self.visible_faces
 
-    def update_visible_faces(self, cubes: dict) -> list:
-        """ Returns all faces that could be seen from the camera's cube
-        i.e. exposed faces that are facing the camera """
+    def in_view(self, centres: np.ndarray, radii: np.ndarray) -> np.ndarray:
+        """ Tests which spheres are at least partly inside the view frustum
+        and within the render distance.
+
+        Parameters:
+            centres: Array of shape (n, 3) of the centres of the spheres
+            radii: Array of shape (n,) of their radii
+
+        Returns:
+            Array of shape (n,) which is True for the spheres in view
+        """
+        relative = centres - self.view_pos.coords
+        in_range = (np.sqrt((relative**2).sum(axis=1)) - radii <=
+                    self.render_distance)
+        # x is the distance in front of the camera, y is to the right and z
+        # is up, and the window is 0.1 wide and 0.1*aspect tall at distance d
+        x, y, z = (relative @ np.array(self.matrix).T).T
+        d = self.direction[0]
+        in_view = in_range & (x >= -radii)
+        for offset, half_size in ((y, 0.05), (z, 0.05*self.aspect)):
+            slope = half_size / d
+            # distance outside each side plane of the frustum
+            outside = (np.abs(offset) - x*slope) / sqrt(1 + slope**2)
+            in_view &= outside <= radii
+        return in_view
+
+    def update_visible_faces(self, world: 'WorldModel') -> list:
+        """ Returns all faces that could be seen from the camera
+        i.e. exposed faces that are facing the camera and are inside the
+        view frustum and render distance """
         # structure of output should be
         # dict[coord: list[list[Face], type, distance]]
+        candidates = []
+        centres = []
+        radii = []
+        view_pos = self.view_pos
+        # chunks far enough away are drawn with their coarser cells instead
+        # of their cubes
+        levels = {}
+        if world.lod_distances:
+            world.refresh_lod()
+            levels = world.get_lod_levels(view_pos)
+        if GREEDY_MESHING:
+            # each merged quad is drawn on its own, ordered by its centre,
+            # which only roughly orders quads wider than a cube (see
+            # get_draw_order)
+            for quad, cube_type, chunk in world.get_quads_facing(view_pos):
+                if levels.get(chunk):
+                    continue
+                c1, c2 = quad.corners
+                candidates.append(([quad], cube_type))
+                centres.append(((c1.x + c2.x)/2, (c1.y + c2.y)/2,
+                                (c1.z + c2.z)/2))
+                radii.append(c1.distance(c2)/2)
+        else:
+            cube_faces = world.get_faces_facing(view_pos)
+            for coord in cube_faces:
+                if levels.get(world.cubes.locate(coord)[0]):
+                    continue
+                x, y, z = coord
+                candidates.append((cube_faces[coord],
+                                   world.cubes.get_type(coord)))
+                centres.append((x + 0.5, y + 0.5, z + 0.5))
+                radii.append(3**0.5 / 2)
+        centres = np.array(centres, dtype=float).reshape(-1, 3)
+        radii = np.array(radii, dtype=float)
+        visible = self.in_view(centres, radii)
+        if levels:
+            coarse_centres = [centres]
+            coarse_radii = [radii]
+            position = np.array(view_pos.coords)
+            for chunk, level in levels.items():
+                if not level:
+                    continue
+                quads, quad_centres, quad_radii, planes = \
+                    world.get_lod_quads(chunk, level)
+                axes, facings, coordinates = planes.T
+                facing = (coordinates - position[axes]) * facings < 0
+                for i in np.flatnonzero(facing).tolist():
+                    face, cube_type = quads[i]
+                    candidates.append(([face], cube_type))
+                coarse_centres.append(quad_centres[facing])
+                coarse_radii.append(quad_radii[facing])
+            centres = np.concatenate(coarse_centres)
+            radii = np.concatenate(coarse_radii)
+            visible = np.concatenate((visible,
+                                      self.in_view(centres[len(visible):],
+                                                   radii[len(visible):])))
+        indices = np.flatnonzero(visible)
+        order, distances = get_draw_order(centres[indices],
+                                          self.cube.corner.coords)
         all_faces = []
-        for coord in cubes:
-            this_cube = cubes[coord]
-            faces = []
-            for face in this_cube.get_exposed():
-                if self.can_see(face):
-                    faces.append(face)
-            cube_type = this_cube.cube_type
-            distance = self.cube.distance(this_cube)
-            if faces:
-                all_faces.append([faces, cube_type, distance])
-        all_faces.sort(key = lambda x: x[2], reverse = True)
+        for i, distance in zip(indices[order].tolist(),
+                               distances[order].tolist()):
+            faces, cube_type = candidates[i]
+            all_faces.append([faces, cube_type, distance])
         self.visible_faces = all_faces
+        # vertices of every visible face in drawing order, shape (n, 4, 3)
+        vertices = [face.get_vertex_coords()
+                    for cube in all_faces for face in cube[0]]
+        self.visible_vertices = np.array(vertices,
+                                         dtype=float).reshape(-1, 4, 3)
+
+    def get_visible_vertices(self) -> np.ndarray:
+        return self.visible_vertices
 
     def get_rotation_matrix(self) -> list[list[float]]:
         _, h_angle, v_angle = self.direction
@@ -357,7 +674,7 @@ class Camera():
         return matrix
 
     def translate_point(self, point: Point) -> Point:
-        return point - self.pos
+        return point - self.view_pos
 
     def rotate_point(self, point: Point) -> Point:
         coords = point.coords
@@ -376,31 +693,51 @@ class Camera():
         return rotated_point
 
     def window_coords(self, face: Face) -> list[tuple[float, float]]:
-        #10/10 style marks for sure definitely great identifier names
-        x = self.direction[0]
-        points = []
-        for vertex in face.get_vertices():
-            new_point = self.transform_point(vertex)
-            points.append(new_point)
-
-        coord_list = []
-        for i, point in enumerate(points):
-            if point.x <= 0:
-                if points[(i-1)%4].x > x:
-                    #generate point between i-1 and i
-                    coords = point.get_intersect(points[(i-1)%4], x)
-                    coord_list.append(coords)
-                if points[(i+1)%4].x > x:
-                    #generate point between i and i+1
-                    coords = point.get_intersect(points[(i+1)%4], x)
-                    coord_list.append(coords)
-            else:
-                #this works lovely
-                y = x * point.y / point.x
-                z = x * point.z / point.x
-                #coords = point.get_intersect(Point((0,0,0)), x)
-                coord_list.append((y,z))
-        return coord_list
+        """ Returns the window coordinates of face clipped to the view. Unlike
+        window_coords_batch, the clip counts of the frame are left alone. """
+        points = self.transform_vertices(
+            np.array([face.get_vertex_coords()], dtype=float))
+        coords, mask, _ = project_points(points, self.direction[0],
+                                         self.aspect)
+        return [tuple(pair) for pair in coords[mask].tolist()]
+
+    def transform_vertices(self, vertices: np.ndarray) -> np.ndarray:
+        """ Vectorised version of transform_point for an array of points """
+        # translate then rotate every vertex with a single matrix multiply
+        return (vertices - self.view_pos.coords) @ np.array(self.matrix).T
+
+    def window_coords_batch(self, vertices: np.ndarray
+                            ) -> tuple[np.ndarray, np.ndarray]:
+        """ Vectorised version of window_coords for many faces at once.
+
+        Parameters:
+            vertices: Array of shape (n, 4, 3) holding the vertices of n faces
+
+        Returns:
+            A tuple (coords, counts) where coords is an (m, 2) array of the
+            window coordinates of every face concatenated in order and counts
+            is the number of coordinate pairs belonging to each face.
+        """
+        return self.project_transformed(self.transform_vertices(vertices))
+
+    def project_transformed(self, points: np.ndarray
+                            ) -> tuple[np.ndarray, np.ndarray]:
+        """ Same as window_coords_batch for faces whose vertices have already
+        been transformed with transform_vertices """
+        if not len(points):
+            self.set_clip_counts(0, 0)
+            return np.empty((0,2)), np.zeros(0, dtype=int)
+        coords, mask, clipped = project_points(points, self.direction[0],
+                                               self.aspect)
+        counts = mask.sum(axis=1)
+        self.set_clip_counts(int((counts == 0).sum()), int(clipped.sum()))
+        return coords[mask], counts
+
+    def set_clip_counts(self, culled: int, clipped: int) -> None:
+        """ Records how many faces the last projection culled for being
+        outside the view and clipped for crossing its edges """
+        self.culled_faces = culled
+        self.clipped_faces = clipped
 
 class Player():
     def __init__(self) -> None:
@@ -408,6 +745,7 @@ class Player():
         self.speed = WALK_SPEED
         self.flying = False
         self.v = 0
+        self.on_ground = False
 
     def set_speed(self, speed: float) -> None:
         self.speed = speed
@@ -424,21 +762,525 @@ class Player():
     def get_velocity(self) -> float:
         return self.v
 
+    def set_on_ground(self, on_ground: bool) -> None:
+        self.on_ground = on_ground
+
+    def is_on_ground(self) -> bool:
+        """ True if the player was stopped by a cube below them on the last
+        move """
+        return self.on_ground
+
+    def get_bounds(self, pos: Point) -> tuple[list[float], list[float]]:
+        """ Returns the lowest and highest corners of the player's bounding
+        box when the camera is at pos """
+        x, y, z = pos.coords
+        low = [x - PLAYER_HALF_WIDTH, y - PLAYER_HALF_WIDTH,
+               z - PLAYER_BELOW_EYE]
+        high = [x + PLAYER_HALF_WIDTH, y + PLAYER_HALF_WIDTH,
+                z + PLAYER_ABOVE_EYE]
+        return low, high
+
+class CubeStore(MutableMapping):
+    """ Maps the corner of each cube in the world to the cube, storing only
+    the block types.
+
+    The world is split into chunks of CHUNK_SIZE cubes along each side, each
+    held as a bytearray of indices into PALETTE (0 meaning empty). Cube
+    objects are only built when looked up, which the renderer does for
+    exposed cubes, and are kept until the cube is removed.
+
+    Attributes:
+        chunks: Maps the position of each chunk to its block types
+        counts: Maps the position of each chunk to its number of cubes
+        materialised: The Cube objects built so far
+    """
+
+    def __init__(self) -> None:
+        self.chunks = {}
+        self.counts = {}
+        self.materialised = {}
+        self.size = 0
+
+    def locate(self, coords: tuple[int, int, int]) -> tuple[tuple[int, int, int],
+                                                            int]:
+        """ Returns the chunk containing coords and the index of coords
+        within that chunk """
+        x, y, z = int(coords[0]), int(coords[1]), int(coords[2])
+        mask = CHUNK_SIZE - 1
+        chunk = (x >> CHUNK_BITS, y >> CHUNK_BITS, z >> CHUNK_BITS)
+        index = ((x & mask) | (y & mask) << CHUNK_BITS |
+                 (z & mask) << 2*CHUNK_BITS)
+        return chunk, index
+
+    def get_index(self, coords: tuple[int, int, int]) -> int:
+        """ Returns the palette index of the block at coords """
+        chunk, index = self.locate(coords)
+        blocks = self.chunks.get(chunk)
+        if blocks is None:
+            return 0
+        return blocks[index]
+
+    def get_type(self, coords: tuple[int, int, int]) -> str:
+        """ Returns the type of the cube at coords, or '.' if empty """
+        return PALETTE[self.get_index(coords)]
+
+    def set_type(self, coords: tuple[int, int, int], cube_type: str) -> None:
+        """ Sets the type of the block at coords, where '.' empties it """
+        chunk, index = self.locate(coords)
+        blocks = self.chunks.get(chunk)
+        if blocks is None:
+            if cube_type == '.':
+                return None
+            blocks = bytearray(CHUNK_VOLUME)
+            self.chunks[chunk] = blocks
+            self.counts[chunk] = 0
+        change = (cube_type != '.') - (blocks[index] != 0)
+        blocks[index] = PALETTE_INDEX[cube_type]
+        self.counts[chunk] += change
+        self.size += change
+        self.materialised.pop(coords, None)
+
+    def load_chunks(self, chunks: dict[tuple[int, int, int], bytearray]
+                    ) -> None:
+        """ Replaces every cube with those in chunks, which map the position
+        of each chunk to its block types """
+        self.chunks = {}
+        self.counts = {}
+        self.materialised = {}
+        self.size = 0
+        for chunk, blocks in chunks.items():
+            count = CHUNK_VOLUME - blocks.count(0)
+            if count:
+                self.chunks[chunk] = blocks
+                self.counts[chunk] = count
+                self.size += count
+
+    def set_chunk(self, chunk: tuple[int, int, int], blocks: bytearray
+                  ) -> None:
+        """ Replaces the block types of chunk with blocks """
+        self.remove_chunk(chunk)
+        count = CHUNK_VOLUME - blocks.count(0)
+        self.chunks[chunk] = blocks
+        self.counts[chunk] = count
+        self.size += count
+
+    def remove_chunk(self, chunk: tuple[int, int, int]) -> None:
+        """ Removes every cube in chunk """
+        if not chunk in self.chunks:
+            return None
+        del self.chunks[chunk]
+        self.size -= self.counts.pop(chunk)
+        for coords in [coords for coords in self.materialised
+                       if self.locate(coords)[0] == chunk]:
+            del self.materialised[coords]
+
+    def get_solid(self, chunk: tuple[int, int, int]) -> np.ndarray | None:
+        """ Returns which cubes of chunk exist as an array indexed by [z, y,
+        x] within the chunk, or None if the chunk is empty """
+        blocks = self.chunks.get(chunk)
+        if blocks is None:
+            return None
+        return np.frombuffer(blocks, np.uint8).reshape(
+            (CHUNK_SIZE,) * 3) != 0
+
+    def snapshot(self) -> dict[tuple[int, int, int], bytes]:
+        """ Returns a copy of the block types of every chunk with a cube in
+        it """
+        return {chunk: bytes(blocks) for chunk, blocks in self.chunks.items()
+                if self.counts[chunk]}
+
+    def get_materialised(self, coords: tuple[int, int, int]) -> 'Cube | None':
+        """ Returns the Cube at coords if it has already been built """
+        return self.materialised.get(coords)
+
+    def __contains__(self, coords: tuple[int, int, int]) -> bool:
+        return self.get_index(coords) != 0
+
+    def __getitem__(self, coords: tuple[int, int, int]) -> Cube:
+        cube = self.materialised.get(coords)
+        if cube is not None:
+            return cube
+        cube_type = self.get_type(coords)
+        if cube_type == '.':
+            raise KeyError(coords)
+        cube = Cube(Point(coords), cube_type)
+        x, y, z = coords
+        for delta, face in cube.faces.items():
+            dx, dy, dz = delta
+            face.set_exposed(not (x+dx, y+dy, z+dz) in self)
+        self.materialised[coords] = cube
+        return cube
+
+    def __setitem__(self, coords: tuple[int, int, int], cube: Cube) -> None:
+        self.set_type(coords, cube.cube_type)
+        self.materialised[coords] = cube
+
+    def __delitem__(self, coords: tuple[int, int, int]) -> None:
+        if not coords in self:
+            raise KeyError(coords)
+        self.set_type(coords, '.')
+
+    def __iter__(self) -> Iterator[tuple[int, int, int]]:
+        for chunk, blocks in list(self.chunks.items()):
+            if not self.counts[chunk]:
+                continue
+            cx, cy, cz = (c << CHUNK_BITS for c in chunk)
+            mask = CHUNK_SIZE - 1
+            for index in np.flatnonzero(np.frombuffer(blocks, np.uint8)):
+                index = int(index)
+                yield (cx + (index & mask),
+                       cy + (index >> CHUNK_BITS & mask),
+                       cz + (index >> 2*CHUNK_BITS))
+
+    def __len__(self) -> int:
+        return self.size
+
 class WorldModel():
-    def __init__(self, map_file) -> None:
-        self.cubes = {}
-        world = read_map(map_file)
-        for z, layer in enumerate(world):
-            for y, row in enumerate(layer):
-                for x, cube_type in enumerate(row):
-                    if not cube_type == '.':
-                        new_cube = Cube(Point((x,y,z)), cube_type)
-                        self.cubes[(x,y,z)] = new_cube
-        for cube in self.cubes:
-            self.update(cube)
+    """ The cubes making up the world along with the player.
+
+    Attributes:
+        cubes: Maps the corner of each cube to the cube (see CubeStore)
+        exposed_faces: Index of every exposed face, bucketed first by the
+            direction the face points (a key of DELTAS) and then by the
+            coordinate of its cube along that direction
+        mesh: The exposed faces of each bucket of exposed_faces merged into
+            as few quads as possible, as lists of (quad, cube_type, chunk)
+        dirty_slices: The buckets whose mesh is out of date
+        lod: The quads drawn for each chunk at each coarser level of detail,
+            as lists of (quad, cube_type, axis, facing, plane)
+        lod_grids: The cells of each chunk at each coarser level of detail
+        dirty_chunks: The chunks whose cubes have changed since lod was last
+            brought up to date
+        lod_distances: The distances at which chunks are drawn at each
+            coarser level of detail (see LOD_DISTANCES), or empty to always
+            draw them in full
+        journal: Told of every cube added or removed, if set (see
+            WorldSaver)
+    """
+
+    def __init__(self, map_file: str | None, cache_dir: str | None = None,
+                 replay_journal: bool = True,
+                 lod_distances: list[float] | None = None) -> None:
+        """ Loads the world from map_file (see load), or starts with an
+        empty world if map_file is None """
+        self.cubes = CubeStore()
+        self.exposed_faces = {delta: {} for delta in DELTAS}
+        self.mesh = {delta: {} for delta in DELTAS}
+        self.dirty_slices = set()
+        self.lod = {}
+        self.lod_grids = {}
+        self.dirty_chunks = set()
+        self.lod_distances = lod_distances or []
+        self.journal = None
+        if map_file is not None:
+            self.load(map_file, cache_dir, replay_journal)
         self.player = Player()
         self.camera = self.player.camera
 
+    def load(self, map_file: str, cache_dir: str | None,
+             replay_journal: bool = True) -> None:
+        """ Loads the world from map_file, a text map or world file, along
+        with the edits journalled since it was last saved unless
+        replay_journal is False.
+
+        The loaded world is cached in cache_dir, if given, and later loads
+        of the same map are read from the cache instead (see load_cache).
+        """
+        cache_file = None
+        if cache_dir:
+            cache_file = get_cache_file(map_file, cache_dir)
+            key = get_cache_key(map_file)
+        if not (cache_file and self.load_cache(cache_file, key)):
+            if map_file.endswith(WORLD_EXTENSION):
+                self.cubes.load_chunks(read_world(map_file))
+            else:
+                self.cubes.load_chunks(read_map_chunks(map_file))
+            self.index_chunks()
+            if cache_file:
+                self.save_cache(cache_file, key)
+        # replay edits journalled since the world was last saved. Until the
+        # first save the journals are of edits to the map itself
+        save_file = get_save_file(map_file)
+        if not replay_journal:
+            return
+        if map_file == save_file or not os.path.exists(save_file):
+            for journal_file in get_journal_files(save_file):
+                if os.path.exists(journal_file):
+                    for coords, cube_type in read_journal(journal_file):
+                        self.set_cube_type(coords, cube_type)
+
+    def load_cache(self, cache_file: str, key: str) -> bool:
+        """ Loads the cubes and exposed face index saved by save_cache,
+        returning False if cache_file does not exist, cannot be read or was
+        saved for a different key (see get_cache_key) """
+        try:
+            with np.load(cache_file) as cache:
+                if str(cache['key']) != key:
+                    return False
+                positions = cache['chunk_positions'].tolist()
+                blocks = cache['chunk_blocks']
+                faces = [cache[f'faces_{i}'] for i in range(len(DELTAS))]
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+            # missing, or cut short by a crash while it was written
+            return False
+        self.cubes.load_chunks({tuple(position): bytearray(chunk)
+                                for position, chunk in zip(positions, blocks)})
+        for delta, coords in zip(DELTAS, faces):
+            self.index_faces(coords, delta, True)
+        return True
+
+    def save_cache(self, cache_file: str, key: str) -> None:
+        """ Saves the cubes and exposed face index to cache_file, replacing
+        any older cache of the same map, along with key """
+        chunks = self.cubes.snapshot()
+        arrays = {'key': np.array(key),
+                  'chunk_positions': np.array(list(chunks), np.int32
+                                              ).reshape(-1, 3),
+                  'chunk_blocks': np.frombuffer(b''.join(chunks.values()),
+                                                np.uint8
+                                                ).reshape(-1, CHUNK_VOLUME)}
+        for i, delta in enumerate(DELTAS):
+            coords = [cube for bucket in self.exposed_faces[delta].values()
+                      for cube in bucket]
+            arrays[f'faces_{i}'] = np.array(coords, np.int32).reshape(-1, 3)
+        os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+        temporary_file = cache_file + '.tmp'
+        with open(temporary_file, 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(temporary_file, cache_file)
+
+    def get_lod_grid(self, chunk: tuple[int, int, int], level: int
+                     ) -> tuple[np.ndarray, np.ndarray] | None:
+        """ Returns chunk at a coarser level of detail, where each cell
+        covers 2**level cubes along each side, as arrays indexed by [z, y, x]
+        of whether each cell is solid and of its palette index. A cell is
+        solid if it has at least as many cubes as one layer of it would, so
+        that floors and walls one cube thick do not vanish, and takes the
+        most common type among them. Cells holding only thinner features,
+        such as a pillar or a rod one cube across, are left empty, so those
+        features vanish at this level. Returns None if chunk is empty. """
+        key = (chunk, level)
+        if not key in self.lod_grids:
+            grid = None
+            if self.cubes.counts.get(chunk):
+                side = 1 << level
+                cells = CHUNK_SIZE >> level
+                blocks = np.frombuffer(self.cubes.chunks[chunk], np.uint8)
+                # group the cubes of each cell together along the last axis
+                blocks = blocks.reshape(cells, side, cells, side, cells, side
+                                        ).transpose(0, 2, 4, 1, 3, 5
+                                                    ).reshape(cells, cells,
+                                                              cells, -1)
+                counts = (blocks[..., np.newaxis]
+                          == np.arange(len(PALETTE))).sum(axis=3)
+                solid = side**3 - counts[..., 0] >= side**2
+                grid = (solid, counts[..., 1:].argmax(axis=3) + 1)
+            self.lod_grids[key] = grid
+        return self.lod_grids[key]
+
+    def get_lod_solid(self, chunk: tuple[int, int, int], level: int
+                      ) -> np.ndarray | None:
+        """ Returns which cells of chunk are solid at level (see
+        get_lod_grid), or None if chunk is empty """
+        if level == 0:
+            return self.cubes.get_solid(chunk)
+        grid = self.get_lod_grid(chunk, level)
+        if grid is None:
+            return None
+        return grid[0]
+
+    def get_chunk_faces(self, chunk: tuple[int, int, int], level: int = 0
+                        ) -> dict[tuple[int, int, int], np.ndarray]:
+        """ Returns the cells of chunk at level (see get_lod_grid) with an
+        exposed face pointing each way, keyed by direction. Cells are given
+        by their corners divided by their size, so at level 0 they are the
+        corners of cubes.
+
+        The whole chunk is compared at once with itself shifted one cell the
+        other way, padded with the edges of the neighbouring chunks.
+        """
+        n = CHUNK_SIZE >> level
+        solid = np.zeros((n + 2,) * 3, bool)
+        solid[1:-1, 1:-1, 1:-1] = self.get_lod_solid(chunk, level)
+        # the arrays are indexed by [z, y, x], so backwards from coordinates
+        for delta in DELTAS:
+            neighbour = self.get_lod_solid(tuple(c + d for c, d
+                                                 in zip(chunk, delta)), level)
+            if neighbour is None:
+                continue
+            axis = 2 - self.get_axis(delta)
+            edge = [slice(1, -1)] * 3
+            edge[axis] = n + 1 if sum(delta) > 0 else 0
+            neighbour_edge = [slice(None)] * 3
+            neighbour_edge[axis] = 0 if sum(delta) > 0 else n - 1
+            solid[tuple(edge)] = neighbour[tuple(neighbour_edge)]
+        inside = solid[1:-1, 1:-1, 1:-1]
+        corner = np.array(chunk) * n
+        faces = {}
+        for dx, dy, dz in DELTAS:
+            covered = solid[1 + dz:n + 1 + dz, 1 + dy:n + 1 + dy,
+                            1 + dx:n + 1 + dx]
+            faces[(dx, dy, dz)] = (np.argwhere(inside & ~covered)[:, ::-1]
+                                   + corner)
+        return faces
+
+    def get_lod_quads(self, chunk: tuple[int, int, int], level: int
+                      ) -> tuple[list[tuple[Face, str]], np.ndarray,
+                                 np.ndarray, np.ndarray]:
+        """ Returns the exposed faces of the cells of chunk at level (see
+        get_lod_grid), merged into quads as in mesh_slice.
+
+        Returns:
+            The quads as (quad, cube_type), an array of shape (n, 3) of
+            their centres, an array of shape (n,) of the radii of their
+            bounding spheres, and an array of shape (n, 3) with the axis
+            each quad is at right angles to, the way it faces along that
+            axis (1 or -1) and its coordinate along that axis
+        """
+        key = (chunk, level)
+        if not key in self.lod:
+            _, types = self.get_lod_grid(chunk, level)
+            side = 1 << level
+            offset = np.array(chunk) * (CHUNK_SIZE >> level)
+            quads = []
+            centres = []
+            radii = []
+            planes = []
+            for delta, cells in self.get_chunk_faces(chunk, level).items():
+                axis = self.get_axis(delta)
+                u, v = [i for i in range(3) if i != axis]
+                facing = delta[axis]
+                layers = {}
+                for cell, (x, y, z) in zip(cells.tolist(),
+                                           (cells - offset).tolist()):
+                    layers.setdefault(cell[axis], {})[(cell[u], cell[v])] = \
+                        PALETTE[types[z, y, x]]
+                for layer, layer_cells in layers.items():
+                    for quad, cube_type, _ in self.merge_cells(
+                            delta, layer, layer_cells, side):
+                        c1, c2 = quad.corners
+                        quads.append((quad, cube_type))
+                        centres.append(((c1.x + c2.x)/2, (c1.y + c2.y)/2,
+                                        (c1.z + c2.z)/2))
+                        radii.append(c1.distance(c2)/2)
+                        planes.append((axis, facing, c1.coords[axis]))
+            self.lod[key] = (quads,
+                             np.array(centres, dtype=float).reshape(-1, 3),
+                             np.array(radii, dtype=float),
+                             np.array(planes, dtype=int).reshape(-1, 3))
+        return self.lod[key]
+
+    def get_lod_levels(self, pos: Point) -> dict[tuple[int, int, int], int]:
+        """ Returns the level of detail each chunk with cubes in it is drawn
+        at from pos (see lod_distances), by the distance to its nearest
+        point so that no cube nearer than the first distance is coarsened """
+        chunks = [chunk for chunk, count in self.cubes.counts.items()
+                  if count]
+        corners = np.array(chunks, dtype=float).reshape(-1, 3) * CHUNK_SIZE
+        nearest = np.clip(pos.coords, corners, corners + CHUNK_SIZE)
+        distances = np.sqrt(((nearest - pos.coords)**2).sum(axis=1))
+        levels = np.searchsorted(self.lod_distances, distances)
+        return dict(zip(chunks, levels.tolist()))
+
+    def refresh_lod(self) -> None:
+        """ Throws away the coarser levels of detail of every chunk that has
+        changed, and of its neighbours, whose exposed faces depend on it """
+        for chunk in self.dirty_chunks:
+            for level in range(1, len(self.lod_distances) + 1):
+                self.lod_grids.pop((chunk, level), None)
+                self.lod.pop((chunk, level), None)
+                for delta in DELTAS:
+                    neighbour = tuple(c + d for c, d in zip(chunk, delta))
+                    self.lod.pop((neighbour, level), None)
+        self.dirty_chunks.clear()
+
+    def index_chunks(self) -> None:
+        """ Builds the exposed face index of every chunk at once, from the
+        exposed faces of each chunk (see get_chunk_faces) """
+        faces = {delta: [] for delta in DELTAS}
+        for chunk in self.cubes.chunks:
+            for delta, coords in self.get_chunk_faces(chunk).items():
+                faces[delta].append(coords)
+        for delta, coords in faces.items():
+            if coords:
+                self.index_faces(np.concatenate(coords), delta, True)
+
+    def update_chunk_border(self, chunk: tuple[int, int, int]) -> None:
+        """ Updates the faces of the cubes in the neighbouring chunks that
+        face chunk, after chunk has been added or removed """
+        n = CHUNK_SIZE
+        solid = self.cubes.get_solid(chunk)
+        for delta in DELTAS:
+            position = tuple(c + d for c, d in zip(chunk, delta))
+            neighbour = self.cubes.get_solid(position)
+            if neighbour is None:
+                continue
+            axis = 2 - self.get_axis(delta)
+            edge = [slice(None)] * 3
+            edge[axis] = n - 1 if sum(delta) > 0 else 0
+            neighbour_edge = [slice(None)] * 3
+            neighbour_edge[axis] = 0 if sum(delta) > 0 else n - 1
+            # the cubes of the neighbour touching chunk, and whether each is
+            # covered by a cube of chunk
+            touching = np.zeros((n,) * 3, bool)
+            touching[tuple(neighbour_edge)] = neighbour[tuple(neighbour_edge)]
+            covered = np.zeros((n,) * 3, bool)
+            if solid is not None:
+                covered[tuple(neighbour_edge)] = solid[tuple(edge)]
+            back = tuple(-d for d in delta)
+            corner = np.array(position) * n
+            for exposed, cells in ((True, touching & ~covered),
+                                   (False, touching & covered)):
+                coords = np.argwhere(cells)[:, ::-1] + corner
+                self.index_faces(coords, back, exposed)
+                if self.cubes.materialised:
+                    for cube in map(self.cubes.get_materialised,
+                                    map(tuple, coords.tolist())):
+                        if cube:
+                            cube.faces[back].set_exposed(exposed)
+
+    def add_chunk(self, chunk: tuple[int, int, int], blocks: bytearray
+                  ) -> None:
+        """ Adds the cubes of a chunk that was not loaded, such as newly
+        generated terrain. Unlike add_cube this is not journalled. """
+        self.cubes.set_chunk(chunk, blocks)
+        self.dirty_chunks.add(chunk)
+        for delta, coords in self.get_chunk_faces(chunk).items():
+            self.index_faces(coords, delta, True)
+        self.update_chunk_border(chunk)
+
+    def remove_chunk(self, chunk: tuple[int, int, int]) -> None:
+        """ Removes every cube in chunk, such as terrain that is no longer
+        needed. Unlike remove_cube this is not journalled. """
+        if not chunk in self.cubes.chunks:
+            return None
+        for delta, coords in self.get_chunk_faces(chunk).items():
+            self.index_faces(coords, delta, False)
+        self.cubes.remove_chunk(chunk)
+        self.dirty_chunks.add(chunk)
+        self.update_chunk_border(chunk)
+
+    def set_cube_type(self, coords: tuple[int, int, int],
+                      cube_type: str) -> None:
+        """ Replaces the cube at coords, if any, with one of cube_type, or
+        just removes it if cube_type is '.' """
+        self.remove_cube(coords)
+        if cube_type != '.':
+            self.add_cube(Cube(Point(coords), cube_type))
+
+    def set_journal(self, journal: 'WorldSaver | None') -> None:
+        self.journal = journal
+
+    def record(self, coords: tuple[int, int, int], cube_type: str) -> None:
+        """ Tells the journal, if any, that the cube at coords is now of
+        cube_type """
+        if self.journal:
+            self.journal.record(coords, cube_type)
+
+    def get_hash(self) -> str:
+        """ Returns a hash of every cube in the world (see get_world_hash) """
+        return get_world_hash(self.cubes.snapshot())
+
     def update_adjacent(self, coords: tuple[int, int, int]) -> None:
         neighbours = Point(coords).get_adjacent()
         for delta in neighbours:
@@ -451,34 +1293,242 @@ class WorldModel():
             # no cube to update
             print(f'No cube to update at {coords}')
             return None
-        cube = self.cubes[coords]
-        neighbours = Point(coords).get_adjacent()
-        for delta in neighbours:
-            if neighbours[delta] in self.cubes:
-                cube.faces[delta].set_exposed(False)
+        # only cubes that have been built need their faces updated
+        cube = self.cubes.get_materialised(coords)
+        x, y, z = coords
+        for delta in DELTAS:
+            dx, dy, dz = delta
+            exposed = not (x+dx, y+dy, z+dz) in self.cubes
+            if cube:
+                cube.faces[delta].set_exposed(exposed)
+            self.index_face(coords, delta, exposed)
+
+    def index_face(self, coords: tuple[int, int, int],
+                   delta: tuple[int, int, int], exposed: bool) -> None:
+        """ Adds or removes the face of the cube at coords facing delta from
+        the exposed face index """
+        layer = coords[self.get_axis(delta)]
+        buckets = self.exposed_faces[delta]
+        bucket = buckets.get(layer, set())
+        if exposed == (coords in bucket):
+            return None
+        self.dirty_chunks.add(self.cubes.locate(coords)[0])
+        if exposed:
+            buckets.setdefault(layer, bucket).add(coords)
+        else:
+            bucket.discard(coords)
+            if not bucket:
+                self.remove_bucket(delta, layer)
+                return None
+        self.dirty_slices.add((delta, layer))
+
+    def index_faces(self, coords: np.ndarray, delta: tuple[int, int, int],
+                    exposed: bool) -> None:
+        """ Adds or removes the faces facing delta of every cube in coords,
+        an (n, 3) array, from the exposed face index at once """
+        axis = self.get_axis(delta)
+        buckets = self.exposed_faces[delta]
+        # group the cubes by layer by sorting them
+        coords = coords[np.argsort(coords[:, axis], kind='stable')]
+        layers, starts = np.unique(coords[:, axis], return_index=True)
+        groups = np.split(coords, starts[1:])
+        for layer, group in zip(layers.tolist(), groups):
+            cubes = map(tuple, group.tolist())
+            if exposed:
+                bucket = buckets.setdefault(layer, set())
+                size = len(bucket)
+                bucket.update(cubes)
             else:
-                cube.faces[delta].set_exposed(True)
+                bucket = buckets.get(layer)
+                if bucket is None:
+                    continue
+                size = len(bucket)
+                bucket.difference_update(cubes)
+                if not bucket:
+                    self.remove_bucket(delta, layer)
+                    continue
+            if len(bucket) != size:
+                self.dirty_slices.add((delta, layer))
+
+    def remove_bucket(self, delta: tuple[int, int, int], layer: int) -> None:
+        """ Forgets a bucket of exposed_faces that has become empty, along
+        with its mesh, so that the index only grows with the world loaded
+        rather than with every layer that has ever been loaded """
+        del self.exposed_faces[delta][layer]
+        self.mesh[delta].pop(layer, None)
+        self.dirty_slices.discard((delta, layer))
+
+    def get_axis(self, delta: tuple[int, int, int]) -> int:
+        """ Returns the index of the axis that delta points along """
+        return 2 - DELTAS.index(delta) // 2
+
+    def get_faces_facing(self, pos: Point) -> dict[tuple[int, int, int],
+                                                   list[Face]]:
+        """ Returns the exposed faces that face pos, grouped by the corner
+        of the cube they belong to """
+        cube_faces = {}
+        for delta in DELTAS:
+            axis = self.get_axis(delta)
+            facing = delta[axis]
+            # faces pointing in the negative direction lie on the cube's
+            # corner, those pointing in the positive direction one further
+            offset = (facing + 1) // 2
+            for layer, bucket in self.exposed_faces[delta].items():
+                if (layer + offset - pos.coords[axis]) * facing >= 0:
+                    continue
+                for coords in bucket:
+                    face = self.cubes[coords].faces[delta]
+                    cube_faces.setdefault(coords, []).append(face)
+        return cube_faces
+
+    def get_quads_facing(self, pos: Point) -> list[tuple[Face, str,
+                                                         tuple[int, int, int]]]:
+        """ Returns the merged quads of exposed faces that face pos, along
+        with their cube types and the chunks they are in, re-meshing any
+        slices that have changed """
+        quads = []
+        for delta in DELTAS:
+            axis = self.get_axis(delta)
+            facing = delta[axis]
+            offset = (facing + 1) // 2
+            for layer in self.exposed_faces[delta]:
+                if (layer + offset - pos.coords[axis]) * facing >= 0:
+                    continue
+                if (delta, layer) in self.dirty_slices:
+                    self.mesh[delta][layer] = self.mesh_slice(delta, layer)
+                    self.dirty_slices.discard((delta, layer))
+                quads.extend(self.mesh[delta].get(layer, ()))
+        return quads
+
+    def mesh_slice(self, delta: tuple[int, int, int],
+                   layer: int) -> list[tuple[Face, str, tuple[int, int, int]]]:
+        """ Greedily merges the exposed faces in one bucket of exposed_faces
+        into rectangles of faces with the same cube type """
+        axis = self.get_axis(delta)
+        u, v = [i for i in range(3) if i != axis]
+        cells = {}
+        for coords in self.exposed_faces[delta].get(layer, ()):
+            cells[(coords[u], coords[v])] = self.cubes.get_type(coords)
+        quads = []
+        for quad, cube_type, (a, b) in self.merge_cells(delta, layer, cells):
+            chunk = [0, 0, 0]
+            chunk[axis] = layer >> CHUNK_BITS
+            chunk[u], chunk[v] = a >> CHUNK_BITS, b >> CHUNK_BITS
+            quads.append((quad, cube_type, tuple(chunk)))
+        return quads
+
+    def merge_cells(self, delta: tuple[int, int, int], layer: int,
+                    cells: dict[tuple[int, int], str], side: int = 1
+                    ) -> list[tuple[Face, str, tuple[int, int]]]:
+        """ Greedily merges the faces pointing delta of a layer of cells
+        into rectangles of faces with the same cube type.
+
+        Parameters:
+            delta: The direction the faces point
+            layer: The coordinate of the cells along delta
+            cells: Maps the position of each cell across delta to its cube
+                type
+            side: The number of cubes along each side of a cell, which is
+                also the unit of layer and the positions
+
+        Returns:
+            (quad, cube_type, position) for each rectangle, where position
+            is that of its first cell
+        """
+        axis = self.get_axis(delta)
+        u, v = [i for i in range(3) if i != axis]
+        _, _, plane_type, facing = FACE_TEMPLATES[DELTAS.index(delta)]
+        plane = (layer + (facing + 1) // 2) * side
+        span = CHUNK_SIZE // side
+        quads = []
+        for start in sorted(cells):
+            if not start in cells:
+                # already merged into an earlier quad
+                continue
+            a, b = start
+            cube_type = cells.pop(start)
+            height = 1
+            # quads never cross chunks, which may be drawn at different
+            # levels of detail
+            while (height < MESH_MAX_SPAN and (b + height) % span and
+                   cells.get((a, b + height)) == cube_type):
+                cells.pop((a, b + height))
+                height += 1
+            width = 1
+            while (width < MESH_MAX_SPAN and (a + width) % span and
+                   all(cells.get((a + width, b + j)) == cube_type
+                       for j in range(height))):
+                for j in range(height):
+                    cells.pop((a + width, b + j))
+                width += 1
+            corner1 = [0, 0, 0]
+            corner2 = [0, 0, 0]
+            corner1[axis] = corner2[axis] = plane
+            corner1[u], corner1[v] = a * side, b * side
+            corner2[u], corner2[v] = (a + width) * side, (b + height) * side
+            quad = Face(Point(tuple(corner1)), Point(tuple(corner2)), facing,
+                        plane_type)
+            quads.append((quad, cube_type, start))
+        return quads
+
+    def get_cells(self, low: float, high: float) -> range:
+        """ Returns the cells along one axis that the interval from low to
+        high overlaps, not counting cells it only touches """
+        return range(floor(low + COLLISION_EPSILON),
+                     ceil(high - COLLISION_EPSILON))
+
+    def box_collides(self, low: list[float], high: list[float]) -> bool:
+        """ True if the box with corners low and high overlaps any cube """
+        get_index = self.cubes.get_index
+        for x in self.get_cells(low[0], high[0]):
+            for y in self.get_cells(low[1], high[1]):
+                for z in self.get_cells(low[2], high[2]):
+                    if get_index((x, y, z)):
+                        return True
+        return False
+
+    def sweep(self, low: list[float], high: list[float], axis: int,
+              distance: float) -> float:
+        """ Moves a box along one axis until it touches a cube.
+
+        Parameters:
+            low, high: The lowest and highest corners of the box
+            axis: The index of the axis to move along
+            distance: How far to move, negative to move backwards
+
+        Returns:
+            How far the box can move before touching a cube, which has the
+            same sign as distance but may be smaller
+        """
+        u, v = [i for i in range(3) if i != axis]
+        cells_u = self.get_cells(low[u], high[u])
+        cells_v = self.get_cells(low[v], high[v])
+        # walk through the layers of cells the leading side passes into
+        if distance > 0:
+            edge = high[axis]
+            first = ceil(edge - COLLISION_EPSILON)
+            layers = range(first, floor(edge + distance) + 1)
+        else:
+            edge = low[axis]
+            first = floor(edge + COLLISION_EPSILON) - 1
+            layers = range(first, floor(edge + distance) - 1, -1)
+        get_index = self.cubes.get_index
+        cell = [0, 0, 0]
+        for layer in layers:
+            cell[axis] = layer
+            for a in cells_u:
+                for b in cells_v:
+                    cell[u] = a
+                    cell[v] = b
+                    if get_index(cell):
+                        if distance > 0:
+                            return max(layer - edge, 0)
+                        return min(layer + 1 - edge, 0)
+        return distance
 
     def collision(self, new: Point) -> bool:
         """ True if moving player to new_pos causes a collision """
-        vertices = [(new.x-0.3, new.y-0.3, new.z-1.62),
-                    (new.x+0.3, new.y-0.3, new.z-1.62),
-                    (new.x-0.3, new.y+0.3, new.z-1.62),
-                    (new.x+0.3, new.y+0.3, new.z-1.62),
-                    (new.x-0.3, new.y-0.3, new.z-0.72),
-                    (new.x+0.3, new.y-0.3, new.z-0.72),
-                    (new.x-0.3, new.y+0.3, new.z-0.72),
-                    (new.x+0.3, new.y+0.3, new.z-0.72),
-                    (new.x-0.3, new.y-0.3, new.z+0.18),
-                    (new.x+0.3, new.y-0.3, new.z+0.18),
-                    (new.x-0.3, new.y+0.3, new.z+0.18),
-                    (new.x+0.3, new.y+0.3, new.z+0.18)]
-        for vertex in vertices:
-            x, y, z = vertex
-            cube_corner = (x//1, y//1, z//1)
-            if cube_corner in self.cubes:
-                return True
-        return False
+        return self.box_collides(*self.player.get_bounds(new))
 
     def move_player(self, keys: list[str]) -> bool:
         direction = Point((0,0,0))
@@ -519,14 +1569,22 @@ class WorldModel():
                 delta += Point(deltas[i]).scale(coord)
             else:
                 delta += Point(deltas[i]).scale(coord*self.player.speed)
-        dx, dy, dz = delta.coords
-        deltas = [(dx,0,0), (0,dy,0), (0,0,dz)]
-        for i, delta in enumerate(deltas):
-            new_pos = self.camera.pos + Point(delta)
-            if not self.collision(new_pos):
-                self.camera.set_pos(new_pos)
-            elif not self.player.is_flying() and i == 2:
+        # sweep the player's box along each axis in turn, stopping exactly
+        # where it touches a cube
+        position = list(self.camera.pos.coords)
+        low, high = self.player.get_bounds(self.camera.pos)
+        self.player.set_on_ground(False)
+        for axis, distance in enumerate(delta.coords):
+            if not distance:
+                continue
+            moved = self.sweep(low, high, axis, distance)
+            position[axis] += moved
+            low[axis] += moved
+            high[axis] += moved
+            if moved != distance and axis == 2 and not self.player.is_flying():
                 self.player.set_velocity(0)
+                self.player.set_on_ground(distance < 0)
+        self.camera.set_pos(Point(tuple(position)))
         if not self.camera.get_cube_corner() == self.camera.cube_corner:
             # player has entered new cube
             return True
@@ -537,11 +1595,52 @@ class WorldModel():
         if coords in self.cubes:
             raise Exception(f'Cube already exists at {cube.corner.coords}')
         self.cubes[coords] = cube
+        self.record(coords, cube.cube_type)
         # update this cube and its neighbours
         self.update(coords)
         self.update_adjacent(coords)
 
+    def hit_scan(self, origin: Point, direction: Point, reach: float,
+                 pierce: int = 1) -> set[tuple[int, int, int]]:
+        """ Returns the cubes destroyed by a shot fired from origin.
+
+        The shot travels through the grid until it has hit pierce cubes or
+        gone reach units. Each cube hit is destroyed along with every cube
+        next to it.
+        """
+        hit = set()
+        for cell, _, _ in grid_traversal(origin.coords,
+                                         direction.get_unit().coords, reach):
+            if not cell in self.cubes:
+                continue
+            hit.add(cell)
+            for neighbour in Point(cell).get_adjacent().values():
+                if neighbour in self.cubes:
+                    hit.add(neighbour)
+            pierce -= 1
+            if not pierce:
+                break
+        return hit
+
+    def remove_cubes(self, cells: set[tuple[int, int, int]]) -> None:
+        """ Removes every cube in cells, updating each affected neighbour
+        once rather than once per removed cube """
+        neighbours = set()
+        for coords in cells:
+            if coords in self.cubes:
+                del self.cubes[coords]
+                self.record(coords, '.')
+                for delta in DELTAS:
+                    self.index_face(coords, delta, False)
+                neighbours.update(Point(coords).get_adjacent().values())
+        for coords in neighbours:
+            if coords in self.cubes:
+                self.update(coords)
+
     def remove_cube(self, coords: tuple[int, int, int]) -> None:
         if coords in self.cubes:
-            self.cubes.pop(coords)
+            del self.cubes[coords]
+            self.record(coords, '.')
+            for delta in DELTAS:
+                self.index_face(coords, delta, False)
             self.update_adjacent(coords)
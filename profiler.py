@@ -0,0 +1,105 @@
+import csv
+import json
+import sys
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator
+from constants import *
+
+class FrameProfiler():
+    """ Times each stage of a frame and keeps rolling statistics.
+
+    Stages are timed with the stage context manager and counters are added
+    with count, both adding to the current frame. end_frame closes the
+    frame, which also records the time since the previous frame ended and
+    the change in the number of memory blocks Python has allocated.
+
+    Attributes:
+        frames: The last PROFILE_WINDOW frames, each a dict mapping a stage
+            or counter name to its time in milliseconds or its count
+        history: Every frame so far, kept for dump
+        startup: Milliseconds from starting the game to drawing the first
+            frame, once known
+    """
+
+    def __init__(self) -> None:
+        self.frames = deque(maxlen=PROFILE_WINDOW)
+        self.history = []
+        self.current = {}
+        self.start = time.perf_counter()
+        self.blocks = sys.getallocatedblocks()
+        self.startup = None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """ Adds the time spent inside the with block to stage name """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.current[name] = self.current.get(name, 0) + elapsed
+
+    def count(self, name: str, amount: int) -> None:
+        """ Adds amount to counter name for this frame """
+        self.current[name] = self.current.get(name, 0) + amount
+
+    def set_startup(self, startup: float) -> None:
+        self.startup = startup
+
+    def end_frame(self) -> None:
+        now = time.perf_counter()
+        blocks = sys.getallocatedblocks()
+        self.current['frame'] = (now - self.start) * 1000
+        self.current['allocated_blocks'] = blocks - self.blocks
+        self.frames.append(self.current)
+        if len(self.history) < PROFILE_HISTORY:
+            self.history.append(self.current)
+        self.current = {}
+        self.start = now
+        self.blocks = blocks
+
+    def get_stats(self) -> dict[str, tuple[float, float, float]]:
+        """ Returns the (mean, 95th percentile, max) of each stage and counter
+        over the last PROFILE_WINDOW frames """
+        stats = {}
+        names = []
+        for frame in self.frames:
+            for name in frame:
+                if not name in names:
+                    names.append(name)
+        for name in names:
+            values = sorted(frame.get(name, 0) for frame in self.frames)
+            mean = sum(values) / len(values)
+            p95 = values[min(int(len(values) * 0.95), len(values) - 1)]
+            stats[name] = (mean, p95, values[-1])
+        return stats
+
+    def get_text(self) -> str:
+        """ Returns the statistics as lines of text for an overlay """
+        lines = [f'{"":<18}{"mean":>9}{"p95":>9}{"max":>9}']
+        for name, (mean, p95, most) in self.get_stats().items():
+            lines.append(f'{name:<18}{mean:>9.2f}{p95:>9.2f}{most:>9.2f}')
+        if self.startup is not None:
+            lines.append(f'{"startup":<18}{self.startup:>9.2f}')
+        return '\n'.join(lines)
+
+    def dump(self, path: str) -> None:
+        """ Writes every frame recorded to path, as JSON if path ends in
+        .json and as CSV otherwise """
+        names = []
+        for frame in self.history:
+            for name in frame:
+                if not name in names:
+                    names.append(name)
+        if path.endswith('.json'):
+            with open(path, 'w') as file:
+                json.dump({'startup': self.startup,
+                           'frames': self.history,
+                           'stats': self.get_stats()}, file, indent=1)
+            return None
+        with open(path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=names, restval=0)
+            writer.writeheader()
+            writer.writerows(self.history)
@@ -0,0 +1,116 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from model import *
+
+# the shared memory each worker process has attached to, keyed by name
+attached = {}
+
+def get_buffers(memory: shared_memory.SharedMemory, capacity: int
+                ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """ Returns the arrays laid out in memory for up to capacity faces: their
+    vertices as in Camera.window_coords_batch and their coordinates, mask
+    and whether they were clipped as returned by project_points """
+    vertices = np.ndarray((capacity, 4, 3), dtype=float, buffer=memory.buf)
+    offset = vertices.nbytes
+    coords = np.ndarray((capacity, CLIP_VERTICES, 2), dtype=float,
+                        buffer=memory.buf, offset=offset)
+    offset += coords.nbytes
+    mask = np.ndarray((capacity, CLIP_VERTICES), dtype=bool,
+                      buffer=memory.buf, offset=offset)
+    offset += mask.nbytes
+    clipped = np.ndarray((capacity,), dtype=bool, buffer=memory.buf,
+                         offset=offset)
+    return vertices, coords, mask, clipped
+
+def get_size(capacity: int) -> int:
+    """ Returns the bytes of shared memory needed for capacity faces """
+    return capacity * (4*3*8 + CLIP_VERTICES*2*8 + CLIP_VERTICES + 1)
+
+def project_range(name: str, capacity: int, start: int, end: int,
+                  position: tuple[float, float, float], matrix: np.ndarray,
+                  distance: float, aspect: float) -> None:
+    """ Projects faces start to end of the shared memory called name for a
+    camera at position with rotation matrix, window distance and aspect.
+    Runs in the worker processes. """
+    if not name in attached:
+        # the buffer has been replaced by a larger one
+        for memory in attached.values():
+            memory.close()
+        attached.clear()
+        attached[name] = shared_memory.SharedMemory(name)
+    vertices, coords, mask, clipped = get_buffers(attached[name], capacity)
+    points = (vertices[start:end] - position) @ matrix.T
+    coords[start:end], mask[start:end], clipped[start:end] = project_points(
+        points, distance, aspect)
+
+class ParallelProjector():
+    """ Projects faces like Camera.window_coords_batch, split across a pool
+    of worker processes.
+
+    The vertices of the faces are copied into shared memory, along with
+    space for the projected coordinates. Each worker is sent only the range
+    of faces it should project and the camera's position and rotation, and
+    writes its results straight into the shared memory, so no faces are
+    pickled. Fewer than min_faces faces are projected in this process, as
+    the round trip to the workers would cost more than it saves.
+
+    Attributes:
+        workers: The number of worker processes
+        min_faces: The fewest faces that are sent to the workers
+        capacity: The number of faces the shared memory has room for
+    """
+
+    def __init__(self, workers: int,
+                 min_faces: int = PARALLEL_MIN_FACES) -> None:
+        self.workers = workers
+        self.min_faces = min_faces
+        self.pool = ProcessPoolExecutor(workers)
+        self.memory = None
+        self.capacity = 0
+        # the vertices last copied into shared memory
+        self.vertices = None
+
+    def reserve(self, faces: int) -> None:
+        """ Makes sure the shared memory has room for faces faces """
+        if faces <= self.capacity:
+            return None
+        if self.memory:
+            self.memory.close()
+            self.memory.unlink()
+        self.capacity = max(faces, 2 * self.capacity)
+        self.memory = shared_memory.SharedMemory(
+            create=True, size=get_size(self.capacity))
+        self.vertices = None
+
+    def window_coords_batch(self, camera: Camera, vertices: np.ndarray
+                            ) -> tuple[np.ndarray, np.ndarray]:
+        """ Same as camera.window_coords_batch(vertices) """
+        n = len(vertices)
+        if n < self.min_faces:
+            return camera.window_coords_batch(vertices)
+        self.reserve(n)
+        shared_vertices, coords, mask, clipped = get_buffers(self.memory,
+                                                             self.capacity)
+        if vertices is not self.vertices:
+            shared_vertices[:n] = vertices
+            self.vertices = vertices
+        bounds = np.linspace(0, n, self.workers + 1).astype(int).tolist()
+        matrix = np.array(camera.matrix)
+        futures = [self.pool.submit(project_range, self.memory.name,
+                                    self.capacity, start, end,
+                                    camera.view_pos.coords, matrix,
+                                    camera.direction[0], camera.aspect)
+                   for start, end in zip(bounds, bounds[1:])]
+        for future in futures:
+            future.result()
+        coords = coords[:n]
+        counts = mask[:n].sum(axis=1)
+        camera.set_clip_counts(int((counts == 0).sum()),
+                               int(clipped[:n].sum()))
+        return coords[mask[:n]], counts
+
+    def close(self) -> None:
+        self.pool.shutdown()
+        if self.memory:
+            self.memory.close()
+            self.memory.unlink()
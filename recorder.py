@@ -0,0 +1,135 @@
+import struct
+from model import *
+
+# the header holds the window size, the seed if any, the hash of the world
+# the game started from and the length of the world file's name, which
+# follows it. Each event is its tick, its index in
+# RECORDING_KINDS, the mouse position and the length of its key's name,
+# which follows it
+RECORDING_HEADER = struct.Struct('<4sBHH?q20sH')
+RECORDING_EVENT = struct.Struct('<IBhhB')
+
+class RecordedEvent():
+    """ An input event, stamped with the number of ticks simulated before it
+    arrived. Has the keysym, x and y of the tk.Event it was recorded from,
+    so it can be handed to the same handlers. """
+
+    def __init__(self, tick: int, kind: str, keysym: str = '', x: int = 0,
+                 y: int = 0) -> None:
+        self.tick = tick
+        self.kind = kind
+        self.keysym = keysym
+        self.x = x
+        self.y = y
+
+    def __repr__(self) -> str:
+        return (f'RecordedEvent({self.tick}, {self.kind!r}, {self.keysym!r}, '
+                f'{self.x}, {self.y})')
+
+class InputRecorder():
+    """ Records the input to a game to a file, so it can be replayed (see
+    InputReplay).
+
+    Events are written as they arrive, each stamped with the tick it arrived
+    at. Besides the keys, mouse movements and clicks, the recording marks
+    each point the game turned the camera by the mouse movement so far
+    ('look') and the tick the game was quit at ('quit'), which is always the
+    last event.
+
+    Attributes:
+        path: The file being recorded to
+        events: The number of events recorded so far
+    """
+
+    def __init__(self, path: str, world_file: str | None, seed: int | None,
+                 world_hash: str, width: int, height: int) -> None:
+        """ Starts recording a game of world_file or of terrain from seed,
+        whose world hashes to world_hash (see WorldModel.get_hash) before
+        any input arrives """
+        self.path = path
+        self.file = open(path, 'wb')
+        name = (world_file or '').encode('utf-8')
+        self.file.write(RECORDING_HEADER.pack(
+            RECORDING_MAGIC, RECORDING_VERSION, width, height,
+            seed is not None, seed or 0, bytes.fromhex(world_hash),
+            len(name)))
+        self.file.write(name)
+        self.events = 0
+
+    def record(self, tick: int, kind: str, event: tk.Event | None = None
+               ) -> None:
+        """ Records an event of kind at tick, with the key and mouse position
+        of event if given """
+        keysym = b''
+        x = y = 0
+        if event is not None:
+            keysym = getattr(event, 'keysym', '').encode('utf-8')
+            x = event.x
+            y = event.y
+        self.file.write(RECORDING_EVENT.pack(
+            tick, RECORDING_KINDS.index(kind), x, y, len(keysym)))
+        self.file.write(keysym)
+        # hand the event to the operating system so it survives a crash
+        self.file.flush()
+        self.events += 1
+
+    def close(self, tick: int) -> None:
+        """ Records that the game was quit at tick and closes the file """
+        self.record(tick, 'quit')
+        self.file.close()
+
+class InputReplay():
+    """ Reads a recording made by InputRecorder back, to feed through a
+    game's handlers at the ticks the events were recorded at.
+
+    Attributes:
+        world_file: The world the recording was played in, or None for
+            procedural terrain
+        seed: The seed of the terrain, if any
+        world_hash: The hash of the world the recording started from (see
+            WorldModel.get_hash)
+        width: The width of the window the recording was made in
+        height: The height of the window the recording was made in
+        events: Every event recorded, in order
+        position: The index of the next event to be fed to the game
+    """
+
+    def __init__(self, path: str) -> None:
+        with open(path, 'rb') as file:
+            data = file.read()
+        if len(data) < RECORDING_HEADER.size:
+            raise ValueError(f'{path} is not a recording this version of the '
+                             f'game can replay')
+        (magic, version, self.width, self.height, has_seed, seed, world_hash,
+         length) = RECORDING_HEADER.unpack_from(data)
+        if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+            raise ValueError(f'{path} is not a recording this version of the '
+                             f'game can replay')
+        offset = RECORDING_HEADER.size
+        self.world_file = data[offset:offset + length].decode('utf-8') or None
+        self.seed = seed if has_seed else None
+        self.world_hash = world_hash.hex()
+        offset += length
+        self.events = []
+        # a recording cut short by a crash ends part way through an event
+        while offset + RECORDING_EVENT.size <= len(data):
+            tick, kind, x, y, length = RECORDING_EVENT.unpack_from(data,
+                                                                   offset)
+            offset += RECORDING_EVENT.size
+            keysym = data[offset:offset + length].decode('utf-8')
+            offset += length
+            self.events.append(RecordedEvent(tick, RECORDING_KINDS[kind],
+                                             keysym, x, y))
+        self.position = 0
+
+    def get_events(self, tick: int) -> list[RecordedEvent]:
+        """ Returns the events not yet fed to the game that were recorded at
+        or before tick """
+        start = self.position
+        while (self.position < len(self.events) and
+               self.events[self.position].tick <= tick):
+            self.position += 1
+        return self.events[start:self.position]
+
+    def is_finished(self) -> bool:
+        return self.position >= len(self.events)
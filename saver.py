@@ -0,0 +1,98 @@
+import threading
+import time
+from model import *
+
+class WorldSaver():
+    """ Saves the world in the background, journalling edits in between.
+
+    Every cube added or removed is appended to a journal next to the world
+    file as it happens, so a crash loses nothing; loading the world replays
+    the journal on top of the last save (see WorldModel). Saving copies the
+    world's chunks and starts a new journal, then a background thread writes
+    the copy to the world file and deletes the journal it has made
+    redundant. Only one save is written at a time, and saves asked for while
+    one is running are started once it has finished.
+
+    Attributes:
+        world_file: The file the world is saved to
+        edits: The number of edits journalled since the last save
+        thread: The thread writing the last save, if any
+        pending: True if a save was asked for while another was running
+    """
+
+    def __init__(self, world: WorldModel, world_file: str) -> None:
+        self.world = world
+        self.world_file = world_file
+        self.old_journal_file, self.journal_file = get_journal_files(
+            world_file)
+        os.makedirs(os.path.dirname(world_file) or '.', exist_ok=True)
+        self.journal = open(self.journal_file, 'ab')
+        self.edits = 0
+        self.thread = None
+        self.pending = False
+        self.last_save = time.perf_counter()
+        world.set_journal(self)
+
+    def record(self, coords: tuple[int, int, int], cube_type: str) -> None:
+        """ Appends an edit setting the cube at coords to cube_type to the
+        journal """
+        self.journal.write(JOURNAL_ENTRY.pack(*coords,
+                                              cube_type.encode('ascii')))
+        # hand the edit to the operating system so it survives a crash
+        self.journal.flush()
+        self.edits += 1
+
+    def is_saving(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def save(self) -> None:
+        """ Starts writing the world to world_file in the background, or
+        once the save being written has finished """
+        if self.is_saving():
+            self.pending = True
+            return None
+        self.pending = False
+        chunks = self.world.cubes.snapshot()
+        # the edits so far are in chunks, so start a new journal. The old one
+        # is kept until chunks have been written in case of a crash
+        self.journal.close()
+        if os.path.exists(self.old_journal_file):
+            # left by a crash while saving, so still needed
+            with open(self.old_journal_file, 'ab') as old_journal, \
+                 open(self.journal_file, 'rb') as journal:
+                old_journal.write(journal.read())
+            os.remove(self.journal_file)
+        else:
+            os.replace(self.journal_file, self.old_journal_file)
+        self.journal = open(self.journal_file, 'ab')
+        self.edits = 0
+        self.last_save = time.perf_counter()
+        self.thread = threading.Thread(target=self.write, args=(chunks,),
+                                       daemon=True)
+        self.thread.start()
+
+    def write(self, chunks: dict[tuple[int, int, int], bytes]) -> None:
+        """ Writes chunks to world_file and deletes the journal of the edits
+        they include. Runs on the background thread. """
+        write_world(self.world_file, chunks)
+        os.remove(self.old_journal_file)
+
+    def update(self) -> None:
+        """ Starts a save if one is waiting or an autosave is due """
+        if self.is_saving():
+            return None
+        due = (AUTOSAVE_INTERVAL is not None and self.edits and
+               time.perf_counter() - self.last_save >= AUTOSAVE_INTERVAL)
+        if self.pending or due:
+            self.save()
+
+    def close(self) -> None:
+        """ Waits for the save being written, if any, and closes the journal.
+        Unsaved edits stay in the journal for the next time the world is
+        loaded. """
+        if self.thread:
+            self.thread.join()
+        if self.pending:
+            self.save()
+            self.thread.join()
+        self.journal.close()
@@ -1,6 +1,23 @@
+import hashlib
+import mmap
+import numpy as np
+import os
+import struct
+import sys
 import tkinter as tk
+import zipfile
+import zlib
 from constants import *
 from math import *
+from typing import Iterator
+
+# the parts of a binary world file (see write_world)
+WORLD_HEADER = struct.Struct('<4sBBB')
+WORLD_BOUNDS = struct.Struct('<6i')
+WORLD_COUNT = struct.Struct('<I')
+WORLD_ENTRY = struct.Struct('<3iQI?')
+# an edit in a journal: a cube's corner and its new type ('.' if removed)
+JOURNAL_ENTRY = struct.Struct('<3ic')
 
 def read_map(map_file: str) -> list[list[str]]:
     """ Reads the map file and returns a list of layers, where each layer is
@@ -12,31 +29,304 @@ def read_map(map_file: str) -> list[list[str]]:
     Returns:
         A list of layers representing the world.
     """
-    with open(map_file, 'r') as file:
-        layers = []
-        new_layer = []
-        for line in file.readlines():
-            if line.strip():
-                new_layer.append(line.strip())
-            else:
-                layers.append(new_layer)
-                new_layer = []
-        layers.append(new_layer)
-        return layers
-
-def save_world(cubes: dict) -> None:
-    with open('worlds/new_world.txt', 'x') as file:
-        for z in range(32):
-            for y in range(32):
-                this_line = ''
-                for x in range(32):
-                    if (x,y,z) in cubes:
-                        this_line += cubes[(x,y,z)].cube_type
-                    else:
-                        this_line += '.'
-                file.write(this_line)
-                file.write('\n')
-            file.write('\n')
+    layers = []
+    new_layer = []
+    for line in read_map_data(map_file).decode('ascii').splitlines():
+        if line.strip():
+            new_layer.append(line.strip())
+        else:
+            layers.append(new_layer)
+            new_layer = []
+    layers.append(new_layer)
+    return layers
+
+def in_worlds_zip(map_file: str) -> bool:
+    """ Returns True if map_file is the name of a file in WORLDS_ZIP """
+    if not os.path.exists(WORLDS_ZIP):
+        return False
+    with zipfile.ZipFile(WORLDS_ZIP) as archive:
+        return map_file in archive.namelist()
+
+def read_map_data(map_file: str) -> bytes:
+    """ Returns the contents of map_file, reading it out of WORLDS_ZIP if
+    it is not a file but is in there """
+    if not os.path.exists(map_file) and in_worlds_zip(map_file):
+        with zipfile.ZipFile(WORLDS_ZIP) as archive:
+            return archive.read(map_file)
+    with open(map_file, 'rb') as file:
+        return file.read()
+
+def find_map(name: str) -> str:
+    """ Returns the path of the map called name, which is either the path
+    itself or the name of a map in the worlds folder, such as 'banana'.
+    Maps are looked for both on disk and in WORLDS_ZIP.
+
+    Raises:
+        FileNotFoundError: If there is no such map
+    """
+    for map_file in (name, f'worlds/{name}.txt'):
+        if os.path.exists(map_file) or in_worlds_zip(map_file):
+            return map_file
+    raise FileNotFoundError(f'No map called {name}')
+
+def write_map(map_file: str, layers: list[list[str]]) -> None:
+    """ Writes layers to map_file in the format read by read_map """
+    with open(map_file, 'w') as file:
+        file.write(''.join(''.join(row + '\n' for row in layer) + '\n'
+                           for layer in layers))
+
+def read_map_blocks(map_file: str) -> np.ndarray:
+    """ Reads map_file (see read_map) into an array of the palette index of
+    every cube, indexed by [z, y, x]. Each row of the map is copied into the
+    array whole, rather than looking at its cubes one by one.
+
+    Raises:
+        ValueError: If the map has a character that is not a block type
+    """
+    layers = [[]]
+    for line in read_map_data(map_file).splitlines():
+        line = line.strip()
+        if line:
+            layers[-1].append(line)
+        else:
+            layers.append([])
+    depth = max(len(layer) for layer in layers)
+    width = max((len(row) for layer in layers for row in layer), default=0)
+    characters = np.full((len(layers), depth, width), ord('.'), np.uint8)
+    for z, layer in enumerate(layers):
+        for y, row in enumerate(layer):
+            characters[z, y, :len(row)] = np.frombuffer(row, np.uint8)
+    # translates characters into palette indices, with 255 for the rest
+    table = np.full(256, 255, np.uint8)
+    table[np.frombuffer(PALETTE.encode('ascii'), np.uint8)] = np.arange(
+        len(PALETTE))
+    blocks = table[characters]
+    if (blocks == 255).any():
+        raise ValueError(f'{map_file} has characters that are not block '
+                         f'types')
+    return blocks
+
+def blocks_to_chunks(blocks: np.ndarray
+                     ) -> dict[tuple[int, int, int], bytearray]:
+    """ Returns the chunks (see CubeStore) holding the cubes in blocks, an
+    array of palette indices indexed by [z, y, x] starting at the origin """
+    n = CHUNK_SIZE
+    shape = [-(-side // n) for side in blocks.shape]
+    grid = np.zeros([side * n for side in shape], np.uint8)
+    grid[tuple(slice(0, side) for side in blocks.shape)] = blocks
+    # [chunk z, chunk y, chunk x, z, y, x]
+    grid = grid.reshape(shape[0], n, shape[1], n, shape[2], n
+                        ).transpose(0, 2, 4, 1, 3, 5)
+    chunks = {}
+    for z, y, x in np.argwhere(grid.any(axis=(3, 4, 5))).tolist():
+        chunks[(x, y, z)] = bytearray(grid[z, y, x].tobytes())
+    return chunks
+
+def read_map_chunks(map_file: str) -> dict[tuple[int, int, int], bytearray]:
+    """ Returns the chunks (see CubeStore) holding the cubes in map_file """
+    return blocks_to_chunks(read_map_blocks(map_file))
+
+def chunks_to_layers(chunks: dict[tuple[int, int, int], bytes]
+                     ) -> list[list[str]]:
+    """ Returns the layers of a map holding every cube in chunks. The map
+    covers every chunk, so it is a whole number of chunks along each side.
+
+    Raises:
+        ValueError: If a chunk has negative coordinates, which a map cannot
+            hold
+    """
+    if not chunks:
+        return []
+    if min(min(chunk) for chunk in chunks) < 0:
+        raise ValueError('maps cannot hold cubes at negative coordinates')
+    width, depth, height = (CHUNK_SIZE * (max(chunk[axis] for chunk in chunks)
+                                          + 1) for axis in range(3))
+    empty = '.' * CHUNK_SIZE
+    layers = []
+    for z in range(height):
+        layer = []
+        for y in range(depth):
+            row = []
+            for x in range(0, width, CHUNK_SIZE):
+                chunk = (x >> CHUNK_BITS, y >> CHUNK_BITS, z >> CHUNK_BITS)
+                blocks = chunks.get(chunk)
+                if blocks is None:
+                    row.append(empty)
+                    continue
+                start = ((y % CHUNK_SIZE) << CHUNK_BITS |
+                         (z % CHUNK_SIZE) << 2*CHUNK_BITS)
+                row.append(bytes(blocks[start:start + CHUNK_SIZE])
+                           .translate(PALETTE_BYTES).decode('ascii'))
+            layer.append(''.join(row))
+        layers.append(layer)
+    return layers
+
+def read_world(world_file: str) -> dict[tuple[int, int, int], bytearray]:
+    """ Reads a binary world file written by write_world and returns its
+    chunks (see CubeStore).
+
+    The file is memory-mapped and each chunk is copied out in one piece, so
+    loading does no work per cube.
+
+    Raises:
+        ValueError: If world_file is not a world file this version can read,
+            or its chunks are not all inside the box its header gives
+    """
+    with open(world_file, 'rb') as file, \
+         mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        magic, version, chunk_bits, palette_size = WORLD_HEADER.unpack_from(
+            data)
+        if magic != WORLD_MAGIC or version != WORLD_VERSION:
+            raise ValueError(f'{world_file} is not a version '
+                             f'{WORLD_VERSION} world file')
+        if chunk_bits != CHUNK_BITS:
+            raise ValueError(f'{world_file} has chunks of side '
+                             f'{1 << chunk_bits}, not {CHUNK_SIZE}')
+        offset = WORLD_HEADER.size
+        palette = data[offset:offset + palette_size].decode('ascii')
+        offset += palette_size
+        # the file's palette may list the block types in a different order
+        remap = None
+        if palette != PALETTE:
+            remap = bytes(PALETTE_INDEX[cube_type] for cube_type in palette
+                          ).ljust(256, b'\0')
+        bounds = WORLD_BOUNDS.unpack_from(data, offset)
+        low = [side // CHUNK_SIZE for side in bounds[:3]]
+        high = [side // CHUNK_SIZE for side in bounds[3:]]
+        offset += WORLD_BOUNDS.size
+        chunk_count, = WORLD_COUNT.unpack_from(data, offset)
+        offset += WORLD_COUNT.size
+        chunks = {}
+        for cx, cy, cz, start, length, compressed in \
+                WORLD_ENTRY.iter_unpack(
+                    data[offset:offset + chunk_count * WORLD_ENTRY.size]):
+            blocks = data[start:start + length]
+            if compressed:
+                blocks = zlib.decompress(blocks)
+            if remap:
+                blocks = blocks.translate(remap)
+            if (len(blocks) != CHUNK_VOLUME or
+                not all(l <= c < h for l, c, h in zip(low, (cx, cy, cz),
+                                                      high))):
+                raise ValueError(f'{world_file} is corrupt: chunk '
+                                 f'{(cx, cy, cz)} does not fit its header')
+            chunks[(cx, cy, cz)] = bytearray(blocks)
+        return chunks
+
+def write_world(world_file: str,
+                chunks: dict[tuple[int, int, int], bytes]) -> None:
+    """ Writes chunks (see CubeStore) to world_file in the binary world
+    format.
+
+    The file starts with a header holding the chunk size, the palette the
+    block types index into and the corners of the box the chunks cover. A
+    table then gives the position of each chunk and where its block types
+    are in the file, followed by the block types themselves, each chunk
+    compressed with zlib if WORLD_COMPRESSION is set and that makes it
+    smaller.
+
+    The file is written under a temporary name and then renamed, so
+    world_file is never left half written.
+    """
+    if chunks:
+        low = [CHUNK_SIZE * min(chunk[axis] for chunk in chunks)
+               for axis in range(3)]
+        high = [CHUNK_SIZE * (max(chunk[axis] for chunk in chunks) + 1)
+                for axis in range(3)]
+    else:
+        low = high = [0, 0, 0]
+    palette = PALETTE.encode('ascii')
+    header = (WORLD_HEADER.pack(WORLD_MAGIC, WORLD_VERSION, CHUNK_BITS,
+                                len(palette)) + palette
+              + WORLD_BOUNDS.pack(*low, *high)
+              + WORLD_COUNT.pack(len(chunks)))
+    start = len(header) + len(chunks) * WORLD_ENTRY.size
+    table = []
+    contents = []
+    for chunk, blocks in chunks.items():
+        blocks = bytes(blocks)
+        compressed = False
+        if WORLD_COMPRESSION:
+            packed = zlib.compress(blocks, WORLD_COMPRESSION)
+            if len(packed) < len(blocks):
+                blocks, compressed = packed, True
+        table.append(WORLD_ENTRY.pack(*chunk, start, len(blocks), compressed))
+        contents.append(blocks)
+        start += len(blocks)
+    temporary_file = world_file + '.tmp'
+    with open(temporary_file, 'wb') as file:
+        file.write(header)
+        file.writelines(table)
+        file.writelines(contents)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_file, world_file)
+
+def get_save_file(map_file: str) -> str:
+    """ Returns the world file that the world loaded from map_file is saved
+    to """
+    return os.path.splitext(map_file)[0] + WORLD_EXTENSION
+
+def get_cache_file(map_file: str, cache_dir: str) -> str:
+    """ Returns the file in cache_dir that the world loaded from map_file is
+    cached in. The name is a hash of map_file's path, so each map has one
+    cache, replaced whenever the map changes (see get_cache_key). """
+    digest = hashlib.sha1(os.path.abspath(map_file).encode('utf-8'))
+    return os.path.join(cache_dir, digest.hexdigest() + '.npz')
+
+def get_cache_key(map_file: str) -> str:
+    """ Returns a hash of the contents of map_file and of how worlds are
+    cached, so a changed map is never loaded from an out of date cache """
+    digest = hashlib.sha1(read_map_data(map_file))
+    digest.update(f'{CACHE_VERSION} {CHUNK_BITS} {PALETTE}'.encode('ascii'))
+    return digest.hexdigest()
+
+def get_world_hash(chunks: dict[tuple[int, int, int], bytes]) -> str:
+    """ Returns a hash of the cubes in chunks (see CubeStore.snapshot), the
+    same for any two worlds with the same cubes """
+    digest = hashlib.sha1()
+    for chunk, blocks in sorted(chunks.items()):
+        digest.update(str(chunk).encode('ascii'))
+        # by block type, so the hash does not depend on the palette's order
+        digest.update(blocks.translate(PALETTE_BYTES))
+    return digest.hexdigest()
+
+def get_journal_files(world_file: str) -> tuple[str, str]:
+    """ Returns the journals of edits to world_file, oldest first. The older
+    journal only exists while (or if a crash happened while) a save was
+    being written """
+    journal_file = world_file + JOURNAL_SUFFIX
+    return journal_file + '.old', journal_file
+
+def read_journal(journal_file: str
+                 ) -> Iterator[tuple[tuple[int, int, int], str]]:
+    """ Yields the corner and new type of each cube edited in journal_file.
+    An edit cut short by a crash is ignored. """
+    with open(journal_file, 'rb') as file:
+        data = file.read()
+    end = len(data) - len(data) % JOURNAL_ENTRY.size
+    for x, y, z, cube_type in JOURNAL_ENTRY.iter_unpack(data[:end]):
+        yield (x, y, z), cube_type.decode('ascii')
+
+def convert_world(source: str, destination: str) -> None:
+    """ Converts between text maps and binary world files, choosing the
+    format of each from whether its name ends in WORLD_EXTENSION """
+    if source.endswith(WORLD_EXTENSION):
+        chunks = read_world(source)
+    else:
+        chunks = read_map_chunks(source)
+    if destination.endswith(WORLD_EXTENSION):
+        write_world(destination, chunks)
+    else:
+        write_map(destination, chunks_to_layers(chunks))
+
+def save_world(cubes: "CubeStore", world_file: str = SAVE_FILE) -> None:
+    """ Saves the cubes to world_file, as a binary world file if its name
+    ends in WORLD_EXTENSION and as a text map otherwise """
+    if world_file.endswith(WORLD_EXTENSION):
+        write_world(world_file, cubes.chunks)
+    else:
+        write_map(world_file, chunks_to_layers(cubes.chunks))
 
 def pol_to_cart(polar_vector: tuple[float, float, float]
                 ) -> tuple[float, float, float]:
@@ -47,3 +337,54 @@ def pol_to_cart(polar_vector: tuple[float, float, float]
     y = -r*sin(h)*cos(v)
     z = r*sin(v)
     return (x,y,z)
+
+def grid_traversal(origin: tuple[float, float, float],
+                   direction: tuple[float, float, float], max_distance: float
+                   ) -> Iterator[tuple[tuple[int, int, int],
+                                       tuple[int, int, int], float]]:
+    """ Walks a ray through the unit cube grid one cell at a time
+    (Amanatides and Woo's algorithm).
+
+    Parameters:
+        origin: The point the ray starts from.
+        direction: The unit vector the ray travels along.
+        max_distance: How far along the ray to walk.
+
+    Yields:
+        Each cell entered by the ray after the one containing origin, as
+        (corner, delta, distance) where delta points from the cell back to
+        the cell the ray came from (i.e. it is the key of the face that was
+        crossed) and distance is how far along the ray the cell was entered.
+    """
+    cell = [int(floor(c)) for c in origin]
+    steps = []
+    t_max = []
+    t_delta = []
+    for i in range(3):
+        d = direction[i]
+        if d > 0:
+            steps.append(1)
+            t_max.append((cell[i] + 1 - origin[i]) / d)
+            t_delta.append(1 / d)
+        elif d < 0:
+            steps.append(-1)
+            t_max.append((origin[i] - cell[i]) / -d)
+            t_delta.append(-1 / d)
+        else:
+            steps.append(0)
+            t_max.append(inf)
+            t_delta.append(inf)
+    while True:
+        axis = t_max.index(min(t_max))
+        distance = t_max[axis]
+        if distance > max_distance:
+            return
+        cell[axis] += steps[axis]
+        t_max[axis] += t_delta[axis]
+        delta = [0, 0, 0]
+        delta[axis] = -steps[axis]
+        yield tuple(cell), tuple(delta), distance
+
+if __name__ == '__main__':
+    # python support.py source destination converts a world between formats
+    convert_world(sys.argv[1], sys.argv[2])
@@ -0,0 +1,180 @@
+from concurrent.futures import ProcessPoolExecutor
+from model import *
+
+def lattice_noise(seed: int, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    """ Returns a pseudo-random number in [0, 1) for each integer point
+    (xs, ys), always the same for the same seed and point """
+    h = (xs.astype(np.int64) * 374761393 + ys.astype(np.int64) * 668265263
+         + seed * 2147483647) & 0xffffffff
+    h = (h ^ (h >> 13)) * 1274126177 & 0xffffffff
+    h ^= h >> 16
+    return h / 2**32
+
+def value_noise(seed: int, xs: np.ndarray, ys: np.ndarray,
+                wavelength: float) -> np.ndarray:
+    """ Returns smooth noise in [0, 1) at each point (xs, ys), varying over
+    distances of about wavelength """
+    xs = xs / wavelength
+    ys = ys / wavelength
+    x0 = np.floor(xs)
+    y0 = np.floor(ys)
+    # smoothstep the fractions so the noise has no creases at the lattice
+    fx = xs - x0
+    fy = ys - y0
+    fx = fx * fx * (3 - 2*fx)
+    fy = fy * fy * (3 - 2*fy)
+    bottom = ((1 - fx) * lattice_noise(seed, x0, y0)
+              + fx * lattice_noise(seed, x0 + 1, y0))
+    top = ((1 - fx) * lattice_noise(seed, x0, y0 + 1)
+           + fx * lattice_noise(seed, x0 + 1, y0 + 1))
+    return (1 - fy) * bottom + fy * top
+
+def get_heights(seed: int, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    """ Returns the height of the ground in the columns of cubes (xs, ys) """
+    heights = np.full(np.shape(xs), float(TERRAIN_BASE))
+    for octave, (amplitude, wavelength) in enumerate(TERRAIN_OCTAVES):
+        heights += amplitude * value_noise(seed + octave, xs, ys, wavelength)
+    return np.clip(heights.astype(int), 1, TERRAIN_HEIGHT - 1)
+
+def generate_chunk(seed: int, chunk: tuple[int, int, int]) -> bytes:
+    """ Returns the block types of chunk (see CubeStore) in the terrain
+    generated from seed. Runs in the terrain worker processes. """
+    n = CHUNK_SIZE
+    cx, cy, cz = (c * n for c in chunk)
+    ys, xs = np.mgrid[cy:cy + n, cx:cx + n]
+    heights = get_heights(seed, xs, ys)[np.newaxis]
+    zs = np.arange(cz, cz + n).reshape(n, 1, 1)
+    # how far below the surface each cube is, with 0 for the surface itself
+    depth = heights - 1 - zs
+    surface = np.where(heights - 1 < TERRAIN_WATER_LEVEL,
+                       PALETTE_INDEX[TERRAIN_SAND],
+                       PALETTE_INDEX[TERRAIN_SURFACE])
+    blocks = np.where(zs < TERRAIN_WATER_LEVEL, PALETTE_INDEX[TERRAIN_WATER],
+                      0)
+    blocks = np.where(depth > TERRAIN_SOIL_DEPTH, PALETTE_INDEX[TERRAIN_ROCK],
+                      blocks)
+    blocks = np.where((depth >= 1) & (depth <= TERRAIN_SOIL_DEPTH),
+                      PALETTE_INDEX[TERRAIN_SOIL], blocks)
+    blocks = np.where(depth == 0, surface, blocks)
+    return blocks.astype(np.uint8).tobytes()
+
+class TerrainStreamer():
+    """ Streams procedural terrain into a world around the camera.
+
+    The terrain is infinite horizontally and TERRAIN_HEIGHT cubes high.
+    Chunks are generated on a pool of worker processes, nearest first, so
+    the Tk thread only has to add each finished chunk to the world. Chunks
+    far behind the camera are removed again to keep memory bounded, and
+    generated afresh when the camera returns, so edits to them are lost.
+
+    Attributes:
+        seed: The seed the terrain is generated from
+        loaded: The chunks that have been generated and added to the world
+            (including empty ones, which are not stored)
+        pending: Maps each chunk being generated to its future
+        unloading: Chunks waiting to be unloaded, a few each frame
+    """
+
+    def __init__(self, world: WorldModel, seed: int) -> None:
+        self.world = world
+        self.seed = seed
+        self.loaded = set()
+        self.pending = {}
+        # the number of chunks the terrain is high
+        self.layers = -(-TERRAIN_HEIGHT // CHUNK_SIZE)
+        self.unloading = []
+        self.centre = None
+        self.wanted = []
+        self.pool = ProcessPoolExecutor(TERRAIN_WORKERS)
+
+    def get_height(self, x: float, y: float) -> int:
+        """ Returns the height of the ground at (x, y) """
+        return int(get_heights(self.seed, np.array(floor(x)),
+                               np.array(floor(y))))
+
+    def get_chunk(self, pos: Point) -> tuple[int, int, int]:
+        """ Returns the chunk containing pos, moved into the terrain's layers
+        of chunks if pos is above or below them """
+        x, y, z = (int(floor(c)) >> CHUNK_BITS for c in pos.coords)
+        return x, y, min(max(z, 0), self.layers - 1)
+
+    def get_wanted(self, centre: tuple[int, int, int]
+                   ) -> list[tuple[int, int, int]]:
+        """ Returns every chunk within TERRAIN_RADIUS columns of centre,
+        nearest first """
+        cx, cy, cz = centre
+        wanted = []
+        for dx in range(-TERRAIN_RADIUS, TERRAIN_RADIUS + 1):
+            for dy in range(-TERRAIN_RADIUS, TERRAIN_RADIUS + 1):
+                if dx*dx + dy*dy > TERRAIN_RADIUS**2:
+                    continue
+                for z in range(self.layers):
+                    wanted.append((dx*dx + dy*dy + (z - cz)**2,
+                                   (cx + dx, cy + dy, z)))
+        return [chunk for _, chunk in sorted(wanted)]
+
+    def is_loaded(self, pos: Point) -> bool:
+        """ Returns True if the terrain around pos has been added to the
+        world """
+        return self.get_chunk(pos) in self.loaded
+
+    def update(self, pos: Point) -> bool:
+        """ Starts generating missing chunks near pos, adds finished ones to
+        the world and unloads those left behind. Returns True if the world
+        changed. """
+        centre = self.get_chunk(pos)
+        changed = False
+        if centre != self.centre:
+            self.centre = centre
+            self.wanted = self.get_wanted(centre)
+            self.find_distant()
+        for chunk in self.unloading[:TERRAIN_CHUNKS_PER_FRAME]:
+            # the camera may have come back since it was queued
+            if not self.is_distant(chunk):
+                continue
+            self.loaded.discard(chunk)
+            if chunk in self.world.cubes.chunks:
+                self.world.remove_chunk(chunk)
+                changed = True
+        del self.unloading[:TERRAIN_CHUNKS_PER_FRAME]
+        for chunk in self.wanted:
+            if len(self.pending) >= TERRAIN_IN_FLIGHT:
+                break
+            if not chunk in self.loaded and not chunk in self.pending:
+                self.pending[chunk] = self.pool.submit(generate_chunk,
+                                                       self.seed, chunk)
+        # every finished chunk is collected, including those the camera has
+        # moved away from since, or they would hold their place in flight
+        finished = [chunk for chunk, future in self.pending.items()
+                    if future.done()]
+        added = 0
+        for chunk in finished:
+            if added >= TERRAIN_CHUNKS_PER_FRAME:
+                break
+            blocks = self.pending.pop(chunk).result()
+            if self.is_distant(chunk):
+                continue
+            added += 1
+            self.loaded.add(chunk)
+            if blocks.count(0) < CHUNK_VOLUME:
+                self.world.add_chunk(chunk, bytearray(blocks))
+                changed = True
+        return changed
+
+    def is_distant(self, chunk: tuple[int, int, int]) -> bool:
+        dx = chunk[0] - self.centre[0]
+        dy = chunk[1] - self.centre[1]
+        return dx*dx + dy*dy > TERRAIN_UNLOAD_RADIUS**2
+
+    def find_distant(self) -> None:
+        """ Queues the chunks further than TERRAIN_UNLOAD_RADIUS columns from
+        the camera to be unloaded, and stops generating any such chunks """
+        for chunk in self.loaded:
+            if self.is_distant(chunk) and not chunk in self.unloading:
+                self.unloading.append(chunk)
+        for chunk in [chunk for chunk in self.pending
+                      if self.is_distant(chunk)]:
+            self.pending.pop(chunk).cancel()
+
+    def close(self) -> None:
+        self.pool.shutdown(cancel_futures=True)
@@ -1,4 +1,5 @@
 from model import *
+from profiler import *
 
 class CanvasButton():
     def __init__(self, master, x1, y1, x2, y2, text: str) -> None:
@@ -10,20 +11,131 @@ class CanvasButton():
         self.text = text
         self.canvas = master
         self.hover = False
+        self.rectangle = None
 
     def draw(self) -> None:
+        """ Draws the button the first time, after that only recolours it """
         if self.hover:
             fill = '#888888'
             outline = '#555555'
         else:
             fill = '#bbbbbb'
             outline = '#888888'
-        self.canvas.create_rectangle(self.coords, fill=fill, width=2,
-                                outline=outline)
+        if self.rectangle:
+            self.canvas.itemconfig(self.rectangle, fill=fill, outline=outline)
+            return None
+        self.rectangle = self.canvas.create_rectangle(self.coords, fill=fill,
+                                                      width=2, outline=outline,
+                                                      tags='menu')
         x = (self.x1 + self.x2)//2
         y = (self.y1 + self.y2)//2
         self.canvas.create_text(x, y, text=self.text, fill='white',
-                           font=('Helvetica 24 bold'))
+                           font=('Helvetica 24 bold'), tags='menu')
+
+class ZBufferRenderer():
+    """ Rasterises faces into a colour buffer using a depth buffer, as an
+    alternative to drawing canvas polygons in painter's order.
+
+    Attributes:
+        width, height: Size of the buffers in pixels
+        scale: Number of window pixels along each side of a buffer pixel
+        colour: The colour buffer, an array of shape (height, width, 3)
+        depth: The depth buffer holding 1/depth of the nearest face drawn
+            to each pixel so far, with 0 meaning nothing has been drawn
+    """
+
+    def __init__(self, width: int, height: int, scale: int) -> None:
+        self.scale = scale
+        self.window_width = width
+        self.width = width // scale
+        self.height = height // scale
+        self.colour = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        self.depth = np.zeros((self.height, self.width))
+        # window coordinates of the centre of each column and row of pixels
+        self.us = ((np.arange(self.width) + 0.5)*scale - width/2) / (10*width)
+        self.vs = (height/2 - (np.arange(self.height) + 0.5)*scale) / (10*width)
+
+    def to_pixels(self, coords: np.ndarray) -> np.ndarray:
+        """ Maps window coordinates onto (column, row) pixel coordinates """
+        pixels = np.empty_like(coords)
+        pixels[:, 0] = (coords[:, 0]*10*self.window_width/self.scale +
+                        self.width/2)
+        pixels[:, 1] = self.height/2 - (coords[:, 1]*10*self.window_width /
+                                        self.scale)
+        return pixels
+
+    def render(self, camera: Camera, colours: np.ndarray,
+               background: tuple[int, int, int]) -> bytes:
+        """ Rasterises the camera's visible faces.
+
+        Parameters:
+            camera: The camera whose visible faces are drawn
+            colours: Array of shape (n, 3) of the colour of each face
+            background: The colour of pixels not covered by any face
+
+        Returns:
+            The rendered image in binary PPM format
+        """
+        self.colour[:] = background
+        self.depth[:] = 0
+        points = camera.transform_vertices(camera.get_visible_vertices())
+        coords, counts = camera.project_transformed(points)
+        d = camera.direction[0]
+        # 1/depth is linear across the window for each face: the point at
+        # window coordinates (u, v) with depth x is x*(1, u/d, v/d), so if
+        # the face's plane is n.p = k then 1/x = (n0 + n1*u/d + n2*v/d)/k
+        normals = np.cross(points[:, 1] - points[:, 0],
+                           points[:, 3] - points[:, 0])
+        k = (normals * points[:, 0]).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            coefficients = normals / k[:, None] * np.array([1, 1/d, 1/d])
+        pixels = self.to_pixels(coords)
+        counts = counts.tolist()
+        ends = np.cumsum(counts).tolist()
+        # faces come in painter's order (see get_draw_order), so going
+        # through them backwards draws the nearest first and the depth test
+        # rejects the faces behind them without filling them in
+        for i in reversed(range(len(ends))):
+            start = ends[i] - counts[i]
+            if counts[i] >= 3 and k[i]:
+                self.fill_polygon(coords[start:ends[i]],
+                                  pixels[start:ends[i]], coefficients[i],
+                                  colours[i])
+        header = f'P6 {self.width} {self.height} 255 '.encode()
+        return header + self.colour.tobytes()
+
+    def fill_polygon(self, coords: np.ndarray, pixels: np.ndarray,
+                     coefficients: np.ndarray, colour: np.ndarray) -> None:
+        """ Fills the pixels inside a convex polygon that are nearer than
+        anything drawn there so far """
+        x1 = max(int(pixels[:, 0].min()), 0)
+        x2 = min(int(pixels[:, 0].max()) + 1, self.width)
+        y1 = max(int(pixels[:, 1].min()), 0)
+        y2 = min(int(pixels[:, 1].max()) + 1, self.height)
+        if x1 >= x2 or y1 >= y2:
+            return None
+        us = self.us[x1:x2][None, :]
+        vs = self.vs[y1:y2][:, None]
+        a, b, c = coefficients
+        depth = self.depth[y1:y2, x1:x2]
+        # 1/depth is largest at a corner of the bounding box, so if nothing
+        # there is nearer than what has been drawn the face is hidden
+        nearest = (a + max(b*us[0, 0], b*us[0, -1])
+                   + max(c*vs[0, 0], c*vs[-1, 0]))
+        if depth.min() >= nearest:
+            return None
+        # a pixel is inside if it is on the same side of every edge
+        edges = np.roll(coords, -1, axis=0) - coords
+        area = (coords[:, 0]*np.roll(coords[:, 1], -1) -
+                np.roll(coords[:, 0], -1)*coords[:, 1]).sum()
+        sign = 1 if area > 0 else -1
+        inside = np.ones((y2 - y1, x2 - x1), dtype=bool)
+        for (u, v), (du, dv) in zip(coords, edges):
+            inside &= (du*(vs - v) - dv*(us - u))*sign >= 0
+        inverse_depth = a + b*us + c*vs
+        inside &= inverse_depth > depth
+        depth[inside] = np.broadcast_to(inverse_depth, inside.shape)[inside]
+        self.colour[y1:y2, x1:x2][inside] = colour
 
 '''
 class MenuView():
@@ -32,20 +144,93 @@ class MenuView():
 '''
     
 class WorldView(tk.Canvas):
-    def __init__(self, master: tk.Tk, width: int, height: int) -> None:
+    """ The canvas the game is drawn on.
+
+    Canvas items are kept between frames rather than deleted and redrawn.
+    Faces are drawn with a pool of polygons which are moved and recoloured
+    each frame, with any left over hidden. The HUD, scope and menu are drawn
+    once and then shown or hidden. From bottom to top the layers are tagged
+    'face', 'outline', 'hud' (made of 'hotbar', 'crosshair' and 'snipe'),
+    'menu' and 'profile'.
+    """
+
+    def __init__(self, master: tk.Tk, width: int, height: int,
+                 profiler: FrameProfiler = None,
+                 projector: 'ParallelProjector | None' = None) -> None:
         super().__init__(master, width=width, height=height, bg='sky blue')
         self.width = width
         self.height = height
+        self.profiler = profiler or FrameProfiler()
+        self.projector = projector
+        self.profile_text = None
         self.face_looked_at = None
         self.bg = 'sky blue'
+        self.shown_bg = 'sky blue'
+        # pooled face polygons and the (fill, width) each was last given
+        self.polygons = []
+        self.styles = []
+        self.polygons_shown = 0
+        self.outline = self.create_polygon(0, 0, 0, 0, 0, 0, outline='black',
+                                           fill='', width=5, state='hidden',
+                                           tags='outline')
+        self.hotbar_selection = None
+        self.shown_layers = None
+        self.backend = RENDER_BACKEND
+        self.zbuffer = ZBufferRenderer(width, height, ZBUFFER_SCALE)
+        # the z-buffer's image is drawn at its own resolution into frame,
+        # which is then scaled up into the image shown on the canvas
+        self.frame = tk.PhotoImage(width=self.zbuffer.width,
+                                   height=self.zbuffer.height)
+        self.image = tk.PhotoImage(width=width, height=height)
+        self.create_image(0, 0, image=self.image, anchor='nw',
+                          state='hidden', tags='image')
+        self.tag_lower('image')
+        self.rgb = {}
 
     def set_bg(self, bg: str) -> None:
         self.bg = bg
 
+    def toggle_backend(self) -> None:
+        """ Switches between drawing polygons and the z-buffer """
+        if self.backend == 'polygon':
+            self.backend = 'zbuffer'
+        else:
+            self.backend = 'polygon'
+
+    def get_rgb(self, colour: str) -> tuple[int, int, int]:
+        """ Returns the 8-bit RGB values of a Tk colour """
+        if not colour in self.rgb:
+            self.rgb[colour] = tuple(c // 256 for c in self.winfo_rgb(colour))
+        return self.rgb[colour]
+
+    def show_bg(self, bg: str) -> None:
+        """ Sets the canvas background if it has changed """
+        if bg != self.shown_bg:
+            self.config(bg=bg)
+            self.shown_bg = bg
+
+    def show_layers(self, layers: tuple[str, ...]) -> None:
+        """ Shows the layers in layers and hides the rest """
+        if layers == self.shown_layers:
+            return None
+        for layer in ('image', 'outline', 'hotbar', 'crosshair', 'snipe',
+                      'menu'):
+            if not layer in layers:
+                self.itemconfig(layer, state='hidden')
+        for layer in layers:
+            if layer != 'face':
+                self.itemconfig(layer, state='normal')
+        if not 'face' in layers:
+            self.itemconfig('face', state='hidden')
+            # pooled polygons are shown again as they are reused
+            self.polygons_shown = 0
+        self.shown_layers = layers
+
     def draw_hotbar(self, current_colour: str) -> None:
         cell_width = self.width // 33
         y1 = self.height - cell_width - 10
         y2 = y1 + cell_width
+        tags = ('hud', 'hotbar')
         for i, colour in enumerate(HOTBAR_COLOURS):
             # top left is (self.width//2 - 5cell_width),(height - cell_width)
             x1 = int(self.width/2 + (i-5.5)*cell_width)
@@ -54,13 +239,39 @@ class WorldView(tk.Canvas):
             colour = COLOURS[colour_code]
             if current_colour == colour_code:
                 index = i
-            self.create_rectangle(x1, y1, x2, y2, fill=colour, width=4,
-                                  outline='grey')
+            if not self.hotbar_selection:
+                self.create_rectangle(x1, y1, x2, y2, fill=colour, width=4,
+                                      outline='grey', tags=tags)
         x1 = int(self.width/2 + (index-5.5)*cell_width)
         x2 = x1 + cell_width
-        self.create_rectangle(x1, y1, x2, y2, width=8, outline='light grey')
+        if self.hotbar_selection:
+            self.coords(self.hotbar_selection, x1, y1, x2, y2)
+        else:
+            self.hotbar_selection = self.create_rectangle(
+                x1, y1, x2, y2, width=8, outline='light grey', tags=tags)
+
+    def draw_crosshair(self) -> None:
+        tags = ('hud', 'crosshair')
+        self.create_line(self.width//2, self.height//2 - 20,
+                         self.width//2, self.height//2 + 20,
+                         fill='grey', width=4, tags=tags)
+        self.create_line(self.width//2 - 20, self.height//2,
+                         self.width//2 + 20, self.height//2,
+                         fill='grey', width=4, tags=tags)
+
+    def draw_hud(self, current_colour: str) -> None:
+        """ Draws every HUD layer and the menu title, all hidden """
+        self.draw_hotbar(current_colour)
+        self.draw_crosshair()
+        self.draw_snipe()
+        self.create_text(self.width//2, 250, text='CUBE GAME', fill='white',
+                         font=('Helvetica 96 bold'), tags='menu')
+        self.itemconfig('hud', state='hidden')
+        self.itemconfig('menu', state='hidden')
 
     def draw_snipe(self) -> None:
+        """ Draws the scope overlay shown in shooting mode """
+        tags = ('hud', 'snipe')
         diameter = self.height + 100
         r = diameter/2
         firstangle = asin(self.height / diameter)
@@ -76,54 +287,192 @@ class WorldView(tk.Canvas):
                    self.width, self.height,
                    self.width, 0]
         mirrored_points = [a if i%2 else self.width - a for i, a in enumerate(points)]
-        self.create_polygon(points, fill='black')
+        self.create_polygon(points, fill='black', tags=tags)
         #print(points)
         #print(mirrored_points)
-        self.create_polygon(mirrored_points, fill='black')
+        self.create_polygon(mirrored_points, fill='black', tags=tags)
         r = int(r)
         k = 40
         self.create_oval(self.width//2 - r + k, self.height//2 - r + k,
-                         self.width//2 + r - k, self.height//2 + r - k, width = 3)
-        self.create_line(self.width//2, 0, self.width//2, self.height, width=2)
+                         self.width//2 + r - k, self.height//2 + r - k, width = 3,
+                         tags=tags)
+        self.create_line(self.width//2, 0, self.width//2, self.height, width=2,
+                         tags=tags)
         self.create_line(self.width//2, self.height//2 + 250,
-                         self.width//2, self.height, width=8)
+                         self.width//2, self.height, width=8, tags=tags)
         self.create_line(self.width//2 - r + k, self.height//2,
-                         self.width//2 + r - k, self.height//2, width=2)
+                         self.width//2 + r - k, self.height//2, width=2,
+                         tags=tags)
         self.create_line(self.width//2 - r + k, self.height//2,
-                         self.width//2 - r + k + 40, self.height//2, width=8)
+                         self.width//2 - r + k + 40, self.height//2, width=8,
+                         tags=tags)
         self.create_line(self.width//2 + r - k, self.height//2,
-                         self.width//2 + r - k - 40, self.height//2, width=8)
+                         self.width//2 + r - k - 40, self.height//2, width=8,
+                         tags=tags)
         for i in range(4):
              self.create_line(self.width//2 - 5, self.height//2 + (i+1)*50-25,
                               self.width//2 + 5, self.height//2 + (i+1)*50-25,
-                              width=2)
+                              width=2, tags=tags)
              self.create_line(self.width//2 - 15, self.height//2 + (i+1)*50,
                               self.width//2 + 15, self.height//2 + (i+1)*50,
-                              width=2)
+                              width=2, tags=tags)
         a = 225
         self.create_rectangle(self.width//2 - a, self.height - 170,
                               self.width//2 + a, self.height - 145, fill='cornflower blue',
-                              width=0)
+                              width=0, tags=tags)
         self.create_text(self.width//2 - a + 40, self.height - 158,
-                           text='100', fill='white', font=('Helvetica 15 bold'))
+                           text='100', fill='white', font=('Helvetica 15 bold'),
+                           tags=tags)
         self.create_rectangle(self.width//2 - a, self.height - 140,
                               self.width//2 + a, self.height - 115, fill='lime',
-                              width=0)
+                              width=0, tags=tags)
         self.create_text(self.width//2 - a + 40, self.height - 128,
-                           text='100', fill='white', font=('Helvetica 15 bold'))
+                           text='100', fill='white', font=('Helvetica 15 bold'),
+                           tags=tags)
+
+    def draw_outline(self, coords: list[tuple[float, float]]) -> None:
+        """ Moves the outline to a face given its window coordinates """
+        mapped_points = []
+        for x, y in coords:
+            mapped_points.append(self.width/2 + x*10*self.width)
+            mapped_points.append(self.height/2 - y*10*self.width)
+        if len(mapped_points) >= 6:
+            self.coords(self.outline, mapped_points)
+            self.itemconfig(self.outline, state='normal')
+        else:
+            self.itemconfig(self.outline, state='hidden')
+
+    def redraw_zbuffer(self, visible_faces: list[list[Face], str, float],
+                       face_looked_at: Face, camera: Camera) -> None:
+        """ Draws the visible faces with the z-buffer renderer """
+        colours = []
+        for faces, cube_type, _ in visible_faces:
+            # shade faces by direction so neighbouring cubes stay distinct
+            rgb = self.get_rgb(COLOURS[cube_type])
+            for face in faces:
+                shade = FACE_SHADES[DELTAS.index(
+                    tuple(face.facing * n for n in face.normal.coords))]
+                colours.append([c*shade for c in rgb])
+        colours = np.array(colours, dtype=np.uint8).reshape(-1, 3)
+        ppm = self.zbuffer.render(camera, colours, self.get_rgb(self.bg))
+        self.frame.configure(data=ppm, format='PPM')
+        scale = self.zbuffer.scale
+        self.tk.call(self.image, 'copy', self.frame, '-zoom', scale, scale)
+        if face_looked_at:
+            self.draw_outline(camera.window_coords(face_looked_at))
+        else:
+            self.itemconfig(self.outline, state='hidden')
+
+    def draw_profile(self, text: str | None) -> None:
+        """ Shows text in the profiler overlay, or hides it if text is None """
+        if text is None:
+            if self.profile_text:
+                self.itemconfig(self.profile_text, state='hidden')
+            return None
+        if not self.profile_text:
+            self.profile_text = self.create_text(10, 10, anchor='nw',
+                                                 fill='white',
+                                                 font=('Courier 12 bold'),
+                                                 tags='profile')
+        self.itemconfig(self.profile_text, text=text, state='normal')
+        self.tag_raise('profile')
+
+    def draw_loading(self, text: str | None) -> None:
+        """ Shows text in the middle of the screen while the world loads, or
+        removes it if text is None """
+        self.delete('loading')
+        if text is not None:
+            self.create_text(self.width//2, self.height//2, text=text,
+                             fill='white', font=('Helvetica 24 bold'),
+                             tags='loading')
 
     def draw_menu(self, buttons) -> None:
-        self.config(bg='saddle brown')
-        self.create_text(self.width//2, 250, text='CUBE GAME', fill='white',
-                         font=('Helvetica 96 bold'))
+        self.show_bg('saddle brown')
+        self.show_layers(('menu',))
         for button in buttons:
             button.draw()
+
+    def draw_polygon(self, index: int, points: list[float], fill: str,
+                     width: int) -> None:
+        """ Draws the index-th face polygon of this frame, reusing a pooled
+        polygon where there is one """
+        if index < len(self.polygons):
+            polygon = self.polygons[index]
+            self.coords(polygon, points)
+            if self.styles[index] != (fill, width):
+                self.itemconfig(polygon, fill=fill, width=width)
+                self.styles[index] = (fill, width)
+            if index >= self.polygons_shown:
+                self.itemconfig(polygon, state='normal')
+            return None
+        polygon = self.create_polygon(points, outline='black', fill=fill,
+                                      width=width, tags='face')
+        self.polygons.append(polygon)
+        self.styles.append((fill, width))
+        # new polygons go on top of everything, so put the layers above back
+        self.tag_raise('outline')
+        self.tag_raise('hud')
+        self.tag_raise('menu')
+        self.tag_raise('profile')
+
+    def hide_polygons(self, count: int) -> None:
+        """ Hides the pooled polygons not used this frame, given that count
+        were used """
+        for polygon in self.polygons[count:self.polygons_shown]:
+            self.itemconfig(polygon, state='hidden')
+        self.polygons_shown = count
         
     def redraw(self, visible_faces: list[list[Face], str, float],
                face_looked_at: Face, camera: Camera, selected_colour: str,
                shooting=False) -> None:
-        #self.delete('all')
-        self.config(bg=self.bg)
+        self.show_bg(self.bg)
+        world_layer = 'face' if self.backend == 'polygon' else 'image'
+        if shooting:
+            self.show_layers((world_layer, 'outline', 'snipe'))
+        else:
+            self.show_layers((world_layer, 'outline', 'hotbar', 'crosshair'))
+            self.draw_hotbar(selected_colour)
+        self.profiler.count('faces', len(camera.get_visible_vertices()))
+        if self.backend == 'zbuffer':
+            with self.profiler.stage('zbuffer'):
+                self.redraw_zbuffer(visible_faces, face_looked_at, camera)
+            self.profiler.count('culled', camera.culled_faces)
+            self.profiler.count('clipped', camera.clipped_faces)
+            return None
+        # project every visible face in one go, then map the window
+        # coordinates onto the canvas with a single vectorised operation
+        with self.profiler.stage('projection'):
+            if self.projector:
+                coords, counts = self.projector.window_coords_batch(
+                    camera, camera.get_visible_vertices())
+            else:
+                coords, counts = camera.window_coords_batch(
+                    camera.get_visible_vertices())
+            scale = 10*self.width
+            mapped = np.empty_like(coords)
+            mapped[:, 0] = self.width/2 + coords[:, 0]*scale
+            mapped[:, 1] = self.height/2 - coords[:, 1]*scale
+            mapped = mapped.ravel().tolist()
+            counts = counts.tolist()
+        self.profiler.count('culled', camera.culled_faces)
+        self.profiler.count('clipped', camera.clipped_faces)
+        with self.profiler.stage('canvas'):
+            self.draw_faces(visible_faces, face_looked_at, mapped, counts)
+        if GREEDY_MESHING and face_looked_at:
+            # the face looked at is part of a larger quad, so outline it
+            self.draw_outline(camera.window_coords(face_looked_at))
+        else:
+            self.itemconfig(self.outline, state='hidden')
+
+    def draw_faces(self, visible_faces: list[list[Face], str, float],
+                   face_looked_at: Face, mapped: list[float],
+                   counts: list[int]) -> None:
+        """ Draws the faces with the pooled polygons given the canvas
+        coordinates of every face concatenated and how many belong to each
+        face """
+        start = 0
+        index = 0
+        drawn = 0
         for cube in visible_faces:
             faces = cube[0]
             cube_type = cube[1]
@@ -133,34 +482,14 @@ class WorldView(tk.Canvas):
             if face_looked_at in faces:
                 line_width = 5
 
-            '''
-            for face in faces:
-                if face is face_looked_at:
-                    line_width = 5
-            '''
-            
-            for face in faces:
-                mapped_points = []
-                coords = camera.window_coords(face)
-                for coord_pair in coords:
-                    x, y = coord_pair
-                    x *= 10*self.width
-                    y *= 10*self.width
-                    x = self.width/2 + x
-                    y = self.height/2 - y
-                    mapped_points.append(x)
-                    mapped_points.append(y)
+            for _ in faces:
+                end = start + 2*counts[index]
                 #draw quad on canvas
-                if len(mapped_points) >= 6:
-                    self.create_polygon(mapped_points, outline='black',
-                                        fill=colour, width=line_width)
-        if shooting:
-            self.draw_snipe()
-        else:
-            self.draw_hotbar(selected_colour)
-            self.create_line(self.width//2, self.height//2 - 20,
-                             self.width//2, self.height//2 + 20,
-                             fill='grey', width=4)
-            self.create_line(self.width//2 - 20, self.height//2,
-                             self.width//2 + 20, self.height//2,
-                             fill='grey', width=4)
+                if counts[index] >= 3:
+                    self.draw_polygon(drawn, mapped[start:end], colour,
+                                      line_width)
+                    drawn += 1
+                start = end
+                index += 1
+        self.hide_polygons(drawn)
+        self.profiler.count('polygons', drawn)